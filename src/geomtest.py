@@ -21,8 +21,10 @@ Created on 26 Nov 2013
 '''
 
 import pylab
+import numpy
 from pycfdmesh.svgloader import beziergonsFromSVG, polygonsFromSVG
 from pycfdmesh.geometry import Point, StraightLine
+from pycfdmesh.edgeindex import polygonEdgeArrays
 
 
 
@@ -38,9 +40,10 @@ def plotBezierGroup(blist):
 
 def plotPolygonGroup(polyList, style='k-'):
     for p in polyList:
-        points = p.getDefiningPoints()
-        pylab.plot(points.getXs(), points.getYs(), style)
-        #print(points.length())
+        # Each side is drawn on its own, so the loops of a polygon with holes aren't joined up.
+        x0, y0, x1, y1 = polygonEdgeArrays(p)
+        gaps = numpy.full(len(x0), numpy.nan)
+        pylab.plot(numpy.stack([x0, x1, gaps], axis=1).ravel(), numpy.stack([y0, y1, gaps], axis=1).ravel(), style)
     pylab.axis('equal')
         
 
@@ -105,6 +108,31 @@ def testPolyPointCheck():
 
 
 
+def testPolygonWithHole():
+    '''
+    arbshape8 is one path: a square with a square hole and a round hole in it. The square hole runs the same way as
+    the outline, so it's only a hole because of the even-odd rule.
+    '''
+    polygons = polygonsFromSVG('./inputgeometries/arbshape8.svg', 1, 0.05)
+    print ("Loaded",len(polygons),"polygon with",len(polygons[0].getEdgeArrays()[0]),"sides.")
+    
+    plist = []
+    plist.append(Point(120, 520)) # True
+    plist.append(Point(170, 570)) # False, in the square hole
+    plist.append(Point(250, 570)) # False, in the round hole
+    plist.append(Point(50, 570)) # False
+    
+    for p in plist:
+        print (p, polygons[0].containsPoint(p))
+    
+    pylab.figure('Polygon with holes')
+    plotPolygonGroup(polygons)
+    pylab.plot([p.x for p in plist], [p.y for p in plist], 'ro')
+    pylab.show()
+
+
+
+
 if __name__ == "__main__":
     #boundingBoxCheck()
     testPolyPointCheck()
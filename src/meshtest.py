@@ -20,11 +20,17 @@ Created on 27 Nov 2013
 '''
 
 import pylab
+from matplotlib.collections import LineCollection
+import numpy
+import gc
+import tracemalloc
 # import math
 from geomtest import plotPolygonGroup
 from pycfdmesh.mesh import Mesh
-from pycfdmesh.geometry import Point
+from pycfdmesh.geometry import Point, ArrayPolygon
+from pycfdmesh.edgeindex import orientedEdgeArrays
 from pycfdmesh.svgloader import polygonsFromSVG
+from pycfdmesh.meshcache import meshFromSVG
 
 
 def plotPolygons(polygons, style='k-'):
@@ -38,6 +44,17 @@ def plotMesh(mesh, style='k-'):
     for poly in polygons:
         points = poly.getDefiningPoints()
         pylab.plot(points.getXs(), points.getYs(),style)
+
+
+def plotMeshEdges(mesh, color='k', linewidth=0.5):
+    '''
+    Draws every edge of a Mesh as a single LineCollection, which is much faster than plotting each cell.
+    '''
+    x0, y0, x1, y1 = mesh.getEdgeArrays()
+    segments = numpy.stack([numpy.stack([x0, y0], axis=1), numpy.stack([x1, y1], axis=1)], axis=1)
+    axes = pylab.gca()
+    axes.add_collection(LineCollection(segments, colors=color, linewidths=linewidth))
+    axes.autoscale_view()
     
 
     
@@ -65,7 +82,7 @@ def testMeshRefinement():
     print("Plotting...\n")
     
     pylab.figure()
-    plotMesh(mesh)
+    plotMeshEdges(mesh)
     #plotMesh(up,'go-')
     #plotMesh(down,'bo-')
     #plotMesh(left,'co-')
@@ -79,23 +96,158 @@ def testMeshRefinement():
         
 
 
+class _BaselinePoint():
+    '''
+    A copy of the layout of the original Point, from before the mesh became a linear quadtree, kept as a reference 
+    for testMemoryUsage.
+    '''
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+class _BaselineBoundingBox():
+    '''
+    A copy of the layout of the original BoundingBox, which stored its four sides as well as its size.
+    '''
+    def __init__(self, center, halfWidth, halfHeight = None):
+        self.center = center
+        self.halfWidth = halfWidth
+        if not halfHeight:
+            self.halfHeight = halfWidth
+        else:
+            self.halfHeight = halfHeight
+        self.left = center.x - self.halfWidth
+        self.right = center.x + self.halfWidth
+        self.top = center.y + self.halfHeight
+        self.bottom = center.y - self.halfHeight
+
+
+class _BaselineElement():
+    '''
+    A copy of the layout of the original Element, where the mesh was a tree of one object per cell. Every element 
+    kept its parent, a list of its children and a dict of the neighbours it had found, and splitting a cell kept 
+    it in the tree alongside its four children.
+    '''
+    def __init__(self, center, cellSize, maxCellSize, minCellSize, parent = None):
+        self.isLeaf = True
+        self.isSolid = None
+        self.isBoundary = False
+        self.Boundary = None
+        
+        self.parent = parent
+        self.children = []
+        
+        self.cellSize = cellSize
+        self.maxCellSize = maxCellSize
+        self.minCellSize = minCellSize
+        
+        self.center = center
+        self.boundingBox = _BaselineBoundingBox(center, cellSize/2)
+        
+        self.neighbours = {'up':None, 'down':None, 'left':None, 'right':None}
+    
+    def split(self):
+        self.isLeaf = False
+        size = self.cellSize/2
+        x, y = self.center.x, self.center.y
+        for dx, dy in [(-1, 1), (1, 1), (1, -1), (-1, -1)]:
+            center = _BaselinePoint(x + dx*size/2, y + dy*size/2)
+            self.children.append(_BaselineElement(center, size, self.maxCellSize, self.minCellSize, self))
+        return self.children
+
+
+def testMemoryUsage(nSplits = 4):
+    '''
+    Prints the number of bytes used per leaf by the mesh itself, and then by an Element for every leaf. For 
+    comparison, the same mesh is first built the way it was before the mesh became a linear quadtree, as a tree of 
+    one unslotted object per cell, using copies of the original Element, Point and BoundingBox (_BaselineElement 
+    and friends). That tree is measured in full, including the cells that have been split, since it needed them.
+    '''
+    tracemalloc.start()
+    
+    before = tracemalloc.get_traced_memory()[0]
+    leaves = [_BaselineElement(_BaselinePoint((i + 0.5)*100, (j + 0.5)*100), 100, 100, 1) 
+              for j in range(10) for i in range(10)]
+    roots = list(leaves)
+    for i in range(nSplits):
+        leaves = [child for leaf in leaves for child in leaf.split()]
+    gc.collect()
+    baselineBytes = tracemalloc.get_traced_memory()[0] - before
+    print("Before: the tree of unslotted elements uses",baselineBytes/len(leaves),"bytes per leaf.")
+    del roots, leaves
+    gc.collect()
+    
+    mesh = Mesh(Point(0,0), 10, 10, 100, 1)
+    for i in range(nSplits):
+        mesh.quadtree.split(range(mesh.quadtree.nLeaves()))
+    mesh.quadtree.balance()
+    gc.collect()
+    meshBytes = tracemalloc.get_traced_memory()[0]
+    nLeaves = mesh.quadtree.nLeaves()
+    print("After: the mesh with",nLeaves,"leaves uses",meshBytes/nLeaves,"bytes per leaf.")
+    
+    before = tracemalloc.get_traced_memory()[0]
+    elements = mesh.getAllElements()
+    elementBytes = tracemalloc.get_traced_memory()[0] - before
+    print("After: slotted elements use",elementBytes/nLeaves,"bytes per leaf.")
+    
+    # Bounding boxes are no longer kept by the elements. This is what it costs to build one for every element anyway.
+    boxes = [e.boundingBox for e in elements]
+    boxBytes = tracemalloc.get_traced_memory()[0] - before - elementBytes
+    print("After: slotted elements and their bounding boxes use",(elementBytes+boxBytes)/nLeaves,"bytes per leaf.")
+    
+    tracemalloc.stop()
+    return elements, boxes
+    
+    
+
+def testAdaptiveRefinement(nSteps = 5):
+    '''
+    Moves a step in density across a mesh, adapting the mesh to it each time, and prints the integral of each state
+    component before and after each call to Mesh.adapt. The state is carried across by Mesh.adapt, so the integrals
+    should be the same.
+    '''
+    mesh = Mesh(Point(0,0), 8, 8, 100, 100/64)
+    tree = mesh.quadtree
+    
+    def cellAreas():
+        spans = tree.leafCoords()[2]
+        return (spans*tree.finestCellSize)**2
+    
+    for step in range(nSteps):
+        # The step lies on a finest cell boundary, so the cell averages are exact on any mesh.
+        stepX = 200 + step*100
+        i, j, spans = tree.leafCoords()
+        left = tree.x0 + i*tree.finestCellSize
+        width = spans*tree.finestCellSize
+        dense = numpy.clip((stepX - left)/width, 0, 1)
+        state = numpy.stack([1 + dense, 100*(1 + dense), numpy.zeros(len(dense)), 2.5e5*(1 + dense)], axis=1)
+        
+        before = (state*cellAreas()[:, None]).sum(axis=0)
+        state = mesh.adapt(mesh.getGradientIndicator(state[:, 0]), 0.1, 0.01, state)
+        after = (state*cellAreas()[:, None]).sum(axis=0)
+        print("Step at x =",stepX,":",tree.nLeaves(),"leaves, largest change in an integral:",
+              numpy.abs(after - before).max(), "of", numpy.abs(before).max())
+    
+    return mesh
+    
+    
+
 def testPloygonTracer():
     minCellSize = 5
-    polygon = polygonsFromSVG('./inputgeometries/arbshape6.svg', minCellSize)[0]
+    polygon = polygonsFromSVG('./inputgeometries/arbshape6.svg', minCellSize, minCellSize/10)[0]
     print("Loaded geometry as polygon with",len(polygon.lines),"sides.")
     bottomLeft = Point(0, 300)
-    mesh = Mesh(bottomLeft, 10, 10, 100, minCellSize)
-    print("Generated coarse background mesh.")
-    mesh.refineAlongPolygon(polygon)
-    print("Mesh refined around geometry.")
-    mesh.markSolidCells(polygon)
-    print("Solid cells identified.")
+    # The mesh is only generated the first time. After that, it's loaded from the cache.
+    mesh = meshFromSVG('./inputgeometries/arbshape6.svg', bottomLeft, 10, 10, 100, minCellSize)
+    print("Generated mesh refined around geometry, with solid cells identified.")
     
     
     pylab.figure()
     
     print("Plotting mesh...")
-    plotMesh(mesh)
+    plotMeshEdges(mesh)
     print("Plotting geometry...")
     plotPolygonGroup([polygon],'r-')
 
@@ -106,6 +258,60 @@ def testPloygonTracer():
 
 
 
+def testMeshWithHole():
+    '''
+    Meshes arbshape8, a square with two holes in it, and checks that the cells in the holes are fluid, and that the
+    solid area from the cut cells is the area of the polygon.
+    '''
+    polygons = polygonsFromSVG('./inputgeometries/arbshape8.svg', 1, 0.05)
+    mesh = Mesh(Point(0, 400), 8, 8, 50, 2)
+    mesh.refineAlongPolygons(polygons)
+    
+    for point, solid in [(Point(120, 520), True), (Point(170, 570), False), (Point(250, 570), False)]:
+        print(point, "is solid:", mesh.getElementAtPoint(point) is None, "expected:", solid)
+    
+    geometry = mesh.computeCutCells(polygons)
+    i, j, spans = mesh.quadtree.leafCoords()
+    solidArea = ((1 - geometry.fluidFraction)*(spans*mesh.quadtree.finestCellSize)**2).sum()
+    x0, y0, x1, y1 = orientedEdgeArrays(polygons[0])
+    print("Solid area:", solidArea, "polygon area:", numpy.sum(x0*y1 - x1*y0)/2)
+    
+    pylab.figure()
+    plotMeshEdges(mesh)
+    plotPolygonGroup(polygons, 'r-')
+    pylab.axis('equal')
+    pylab.show()
+
+
+
+def testCutCellsNearGridLine():
+    '''
+    Builds an L shape with two of its vertices a tiny distance above a grid line, and meshes arbshape8 with the
+    mesh moved so that the bottom of the round hole sits just off the edge of a cell. In both cases the fluid
+    fractions should stay between 0 and 1, and the solid area from the cut cells should be the area of the polygon.
+    '''
+    xs = [10, 16, 16, 12.5, 12.5, 10]
+    ys = [10, 10, 20 + 1e-12, 20 + 1e-12, 25, 25]
+    shape = ArrayPolygon(xs, ys, xs[1:] + xs[:1], ys[1:] + ys[:1])
+    
+    for polygons, mesh in [([shape], Mesh(Point(0, 0), 4, 4, 8, 1)),
+                           (polygonsFromSVG('./inputgeometries/arbshape8.svg', 1, 0.05),
+                            Mesh(Point(0, 400.0000247), 8, 8, 50, 2))]:
+        mesh.refineAlongPolygons(polygons)
+        geometry = mesh.computeCutCells(polygons)
+        i, j, spans = mesh.quadtree.leafCoords()
+        solidArea = ((1 - geometry.fluidFraction)*(spans*mesh.quadtree.finestCellSize)**2).sum()
+        polygonArea = 0
+        for polygon in polygons:
+            x0, y0, x1, y1 = orientedEdgeArrays(polygon)
+            polygonArea += numpy.sum(x0*y1 - x1*y0)/2
+        print("Fluid fractions from", geometry.fluidFraction.min(), "to", geometry.fluidFraction.max())
+        print("Solid area:", solidArea, "polygon area:", polygonArea)
+        if polygons[0] is shape:
+            index = mesh.quadtree.leafIndexAtPoint(13, 21)
+            print("Fluid fraction above the step:", geometry.fluidFraction[index], "expected: 0.75")
+
+
 
 
 if __name__ == "__main__":    
@@ -0,0 +1,97 @@
+'''
+This file is a part of BreezyNS - a simple, general-purpose 2D airflow calculator.
+
+Copyright (c) 2013, Brendan Gray
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+
+
+Created on 17 Oct 2026
+
+@author: AlphanumericSheepPig
+
+A module for saving a set of named numpy arrays to a single binary file, and loading them again.
+
+The file starts with an 8 byte tag identifying what kind of file it is, then the length of a JSON header as an 8 byte
+little endian integer, then the header itself. The header holds any extra information the caller wants to keep,
+along with the dtype, shape and position of each array. The raw array data follows, with each array starting on a
+64 byte boundary so that it can be memory mapped directly instead of being read into memory.
+'''
+
+import json
+import struct
+import numpy
+
+
+ALIGNMENT = 64
+
+
+def saveArrays(filename, tag, info, arrays):
+    '''
+    Saves a dict of numpy arrays to a file. "tag" is an 8 byte bytes object identifying the type of file, and
+    "info" is a dict of anything else that can be stored as JSON.
+    '''
+    if len(tag) != 8:
+        raise Exception("The file tag must be exactly 8 bytes long.")
+
+    # The header holds the array offsets, which depend on the header's own length, so the data is measured from
+    # the end of the (padded) header.
+    layout = {}
+    contiguous = {}
+    offset = 0
+    for name in sorted(arrays):
+        array = numpy.ascontiguousarray(arrays[name])
+        contiguous[name] = array
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += -(-array.nbytes//ALIGNMENT)*ALIGNMENT
+    header = json.dumps({'info': info, 'arrays': layout}).encode('utf-8')
+    headerLength = -(-(len(header) + 16)//ALIGNMENT)*ALIGNMENT - 16
+    header = header.ljust(headerLength, b' ')
+
+    with open(filename, 'wb') as f:
+        f.write(tag)
+        f.write(struct.pack('<Q', headerLength))
+        f.write(header)
+        for name in sorted(contiguous):
+            data = contiguous[name].tobytes()
+            f.write(data)
+            f.write(b'\0'*(-len(data) % ALIGNMENT))
+
+
+def loadArrays(filename, tag, mmap = True):
+    '''
+    Loads a file written by saveArrays, and returns the info dict and a dict of arrays. If "mmap" is True, the arrays
+    are memory mapped copy-on-write: they can be changed in memory, but the file is never modified.
+    '''
+    with open(filename, 'rb') as f:
+        fileTag = f.read(8)
+        if fileTag != tag:
+            raise Exception("The file "+filename+" is not the expected type of file.")
+        headerLength = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(headerLength).decode('utf-8'))
+        dataStart = 16 + headerLength
+
+        arrays = {}
+        for name, layout in header['arrays'].items():
+            dtype = numpy.dtype(layout['dtype'])
+            shape = tuple(layout['shape'])
+            count = int(numpy.prod(shape))
+            if count == 0:
+                arrays[name] = numpy.zeros(shape, dtype=dtype)
+            elif mmap:
+                arrays[name] = numpy.memmap(filename, dtype=dtype, mode='c', offset=dataStart+layout['offset'],
+                                            shape=shape)
+            else:
+                f.seek(dataStart + layout['offset'])
+                arrays[name] = numpy.fromfile(f, dtype=dtype, count=count).reshape(shape)
+
+    return header['info'], arrays
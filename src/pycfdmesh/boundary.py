@@ -23,8 +23,13 @@ Created on 29 Nov 2013
 
 class Boundary():
 
-    def __init__(self, boundaryType, normal):
+    def __init__(self, boundaryType, normal, length = None):
+        '''
+        "normal" is a Point giving the unit normal of the boundary, pointing into the fluid, and "length" is the 
+        length of the boundary inside the element it belongs to.
+        '''
         self.normal = normal
         self.boundaryType = boundaryType
+        self.length = length
         
         
\ No newline at end of file
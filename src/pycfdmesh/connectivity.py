@@ -0,0 +1,221 @@
+'''
+This file is a part of BreezyNS - a simple, general-purpose 2D airflow calculator.
+
+Copyright (c) 2013, Brendan Gray
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+
+
+Created on 17 Oct 2026
+
+@author: AlphanumericSheepPig
+
+A module which provides a FaceTable, a flat list of every face between the leaves of a LinearQuadtree.
+
+Where two neighbouring leaves differ in size, the larger leaf has one face for each of the smaller leaves along that
+side (hanging node faces), so every face is shared by exactly two cells, or by one cell and the edge of the mesh.
+'''
+
+import numpy
+
+
+class FaceTable():
+    '''
+    Stores the faces between leaves as arrays, one entry per face:
+        FaceTable.left and FaceTable.right contain the leaf indices of the cells on either side of the face. The
+            normal points from left to right. On the edge of the mesh, right is -1 and the normal points outward.
+        FaceTable.length contains the length of the face, which is the size of the smaller cell.
+        FaceTable.normalX and FaceTable.normalY contain the unit normal of the face.
+        FaceTable.centerX and FaceTable.centerY contain the midpoint of the face.
+        FaceTable.isHanging is True for faces between cells of different sizes.
+    The faces touching each cell are also stored in compressed sparse row form: the faces of leaf n are given by
+    FaceTable.cellFaces[FaceTable.cellFaceOffsets[n]:FaceTable.cellFaceOffsets[n+1]].
+    '''
+
+    def __init__(self, quadtree):
+        '''
+        Builds the faces for the current leaves of the quadtree. The table is not updated if the quadtree changes;
+        "FaceTable.version" records which version of the quadtree it was built from.
+        '''
+        self.version = quadtree.version
+        self.nCells = quadtree.nLeaves()
+
+        i, j, spans = quadtree.leafCoords()
+        levels = quadtree.levels
+        cells = numpy.arange(self.nCells)
+        h = quadtree.finestCellSize
+
+        left, right, length, normalX, normalY, centerX, centerY = [], [], [], [], [], [], []
+
+        # Each direction is given by the unit normal, the finest cell just across the side of the cell, and the
+        # midpoint of that side, all in finest cell units.
+        directions = [( 1, 0, i + spans, j,          i + spans,      j + spans/2),
+                      ( 0, 1, i,         j + spans,  i + spans/2,    j + spans),
+                      (-1, 0, i - 1,     j,          i,              j + spans/2),
+                      ( 0,-1, i,         j - 1,      i + spans/2,    j)]
+
+        for nx, ny, probeI, probeJ, midI, midJ in directions:
+            neighbours = quadtree.leafIndicesAtFinestCoords(probeI, probeJ)
+            neighbourLevels = levels[numpy.maximum(neighbours, 0)]
+            onEdge = neighbours < 0
+
+            # Each interior face is added once, from the side of the smaller cell, or from the left or lower cell
+            # if they're the same size. The larger cell only touches the part of its side next to the smaller cell.
+            if nx + ny > 0:
+                owned = ~onEdge & (neighbourLevels <= levels)
+                faceLeft, faceRight = cells[owned], neighbours[owned]
+            else:
+                owned = ~onEdge & (neighbourLevels < levels)
+                faceLeft, faceRight = neighbours[owned], cells[owned]
+
+            for mask, l, r, faceNx, faceNy in [(owned, faceLeft, faceRight, abs(nx), abs(ny)),
+                                               (onEdge, cells[onEdge], neighbours[onEdge], nx, ny)]:
+                left.append(l)
+                right.append(r)
+                length.append(spans[mask]*h)
+                normalX.append(numpy.full(len(l), faceNx, dtype=float))
+                normalY.append(numpy.full(len(l), faceNy, dtype=float))
+                centerX.append(quadtree.x0 + midI[mask]*h)
+                centerY.append(quadtree.y0 + midJ[mask]*h)
+
+        self.left = numpy.concatenate(left)
+        self.right = numpy.concatenate(right)
+        self.length = numpy.concatenate(length)
+        self.normalX = numpy.concatenate(normalX)
+        self.normalY = numpy.concatenate(normalY)
+        self.centerX = numpy.concatenate(centerX)
+        self.centerY = numpy.concatenate(centerY)
+
+        interior = self.right >= 0
+        self.isHanging = numpy.zeros(len(self.left), dtype=bool)
+        self.isHanging[interior] = levels[self.left[interior]] != levels[self.right[interior]]
+
+        self._sortFaces()
+
+
+    def _sortFaces(self):
+        '''
+        Sorts the faces by the cells on either side, so that a loop over the faces works through the cells in order
+        instead of jumping about, and then builds the cell to face lookup.
+        '''
+        order = numpy.lexsort((self.right, self.left))
+        for name in ['left', 'right', 'length', 'normalX', 'normalY', 'centerX', 'centerY', 'isHanging']:
+            setattr(self, name, getattr(self, name)[order])
+
+        # Build the cell to face lookup by sorting a list of (cell, face) pairs by cell.
+        interior = self.right >= 0
+        faces = numpy.arange(len(self.left))
+        owners = numpy.concatenate([self.left, self.right[interior]])
+        ownedFaces = numpy.concatenate([faces, faces[interior]])
+        order = numpy.argsort(owners, kind='stable')
+        self.cellFaces = ownedFaces[order]
+        self.cellFaceOffsets = numpy.zeros(self.nCells + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(owners, minlength=self.nCells), out=self.cellFaceOffsets[1:])
+
+
+    def renumbered(self, order):
+        '''
+        Returns a copy of the table with the cells numbered differently: cell n of the new table is cell order[n] of
+        this one. The faces are sorted again to follow the new numbering.
+        '''
+        rank = numpy.empty(self.nCells, dtype=numpy.int64)
+        rank[order] = numpy.arange(self.nCells)
+        table = FaceTable.__new__(FaceTable)
+        for name in FaceTable.ARRAYS:
+            setattr(table, name, getattr(self, name))
+        table.version = self.version
+        table.nCells = self.nCells
+        table.left = rank[self.left]
+        table.right = numpy.where(self.right >= 0, rank[numpy.maximum(self.right, 0)], -1)
+        table._sortFaces()
+        return table
+
+
+    ARRAYS = ['left', 'right', 'length', 'normalX', 'normalY', 'centerX', 'centerY', 'isHanging', 
+              'cellFaces', 'cellFaceOffsets']
+    
+    
+    def getArrays(self):
+        '''
+        Returns a dict of all the arrays making up the table, e.g. for saving to a file.
+        '''
+        return dict((name, getattr(self, name)) for name in FaceTable.ARRAYS)
+    
+    
+    @classmethod
+    def fromArrays(cls, arrays, version):
+        '''
+        Recreates a table from the arrays returned by getArrays, for the given version of the quadtree.
+        '''
+        table = cls.__new__(cls)
+        for name in FaceTable.ARRAYS:
+            setattr(table, name, arrays[name])
+        table.version = version
+        table.nCells = len(table.cellFaceOffsets) - 1
+        return table
+
+
+    def nFaces(self):
+        return len(self.left)
+
+
+    def getCellFaces(self, cell):
+        '''
+        Returns an array of the indices of the faces touching a leaf.
+        '''
+        return self.cellFaces[self.cellFaceOffsets[cell]:self.cellFaceOffsets[cell+1]]
+
+
+    def getCellNeighbours(self, cell):
+        '''
+        Returns an array of the leaf indices of the cells sharing a face with a leaf.
+        '''
+        faces = self.getCellFaces(cell)
+        others = numpy.where(self.left[faces] == cell, self.right[faces], self.left[faces])
+        return others[others >= 0]
+
+
+    def labelRegions(self, mask):
+        '''
+        Labels the connected regions formed by the cells where "mask" is True, where two cells are connected if they
+        share a face. Returns an array with one label per cell, which is the lowest leaf index in its region, or -1 
+        where the mask is False.
+        '''
+        mask = numpy.asarray(mask, dtype=bool)
+        interior = self.right >= 0
+        a = self.left[interior]
+        b = self.right[interior]
+        linked = mask[a] & mask[b]
+        a = a[linked]
+        b = b[linked]
+        
+        # Repeatedly hook each cell onto the lowest label across its faces, and then shortcut chains of labels by 
+        # pointer jumping. This converges in a handful of passes, however large the regions are.
+        labels = numpy.arange(self.nCells)
+        while True:
+            previous = labels.copy()
+            lowest = numpy.minimum(labels[a], labels[b])
+            numpy.minimum.at(labels, labels[a], lowest)
+            numpy.minimum.at(labels, labels[b], lowest)
+            while True:
+                jumped = labels[labels]
+                if numpy.array_equal(jumped, labels):
+                    break
+                labels = jumped
+            if numpy.array_equal(labels, previous):
+                break
+        
+        return numpy.where(mask, labels, -1)
+
+
+    def __repr__(self):
+        return "Face table with "+str(self.nFaces())+" faces between "+str(self.nCells)+" cells."
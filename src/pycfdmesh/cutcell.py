@@ -0,0 +1,271 @@
+'''
+This file is a part of BreezyNS - a simple, general-purpose 2D airflow calculator.
+
+Copyright (c) 2013, Brendan Gray
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+
+
+Created on 17 Oct 2026
+
+@author: AlphanumericSheepPig
+
+A module which works out the geometry of the cells cut by the boundary of a solid body.
+
+Each side of each polygon is clipped to every cell it passes through. The clipped pieces give the wall inside the
+cell directly. Walking anticlockwise around the edge of a cell, the boundary switches from solid to fluid wherever
+the polygon enters the cell, and from fluid to solid wherever it leaves, which gives how much of each face is
+covered by the solid. The solid area then follows from Green's theorem, using the wall pieces and the covered parts
+of the faces as the boundary of the solid part of the cell.
+'''
+
+import numpy
+from pycfdmesh.geometry import Point
+from pycfdmesh.boundary import Boundary
+from pycfdmesh.quadtree import mortonDecode, SOLID
+from pycfdmesh.edgeindex import EdgeIndex, orientedEdgeArrays
+
+
+class CutCellGeometry():
+    '''
+    Stores the geometry of every leaf of a mesh, as arrays indexed by leaf:
+        CutCellGeometry.fluidFraction is the fraction of the cell's area that is fluid.
+        CutCellGeometry.faceFractions has shape (n, 4), and gives the fraction of the right, top, left and bottom
+            faces of the cell that is wetted by fluid (the same order as the directions in a FaceTable).
+        CutCellGeometry.wallLength is the total length of wall inside the cell.
+        CutCellGeometry.wallNormalX and CutCellGeometry.wallNormalY give the average unit normal of the wall, pointing
+            out of the solid and into the fluid.
+        CutCellGeometry.isCut is True for cells which contain some wall.
+    Cells that aren't cut are either all fluid or all solid, depending on whether they are marked as solid.
+    '''
+
+    def __init__(self, mesh, polygons):
+        tree = mesh.quadtree
+        self.version = tree.version
+        n = tree.nLeaves()
+
+        solidArea = numpy.zeros(n)
+        covered = numpy.zeros((n, 4))
+        wallX = numpy.zeros(n)
+        wallY = numpy.zeros(n)
+        wallLength = numpy.zeros(n)
+        crossed = numpy.zeros(n, dtype=bool)
+
+        for polygon in polygons:
+            self.addPolygon(tree, polygon, solidArea, covered, wallX, wallY, wallLength, crossed)
+
+        sizes = tree.maxCellSize/numpy.left_shift(1, tree.levels.astype(numpy.int64))
+        solid = (tree.flags & SOLID) != 0
+        self.isCut = wallLength > 0
+
+        # Where the walls never cross the edge of a cell, because they only touch it or are loops lying inside it,
+        # the whole edge is on one side of them and Green's theorem has only given the area of the loops. The
+        # middles of the faces are tested, and the cell is counted as solid if most of them are inside a body.
+        enclosed = numpy.nonzero(self.isCut & ~crossed)[0]
+        if len(enclosed) > 0:
+            i, j, _ = tree.leafCoords()
+            h = sizes[enclosed]
+            cx = tree.x0 + i[enclosed]*tree.finestCellSize + h/2
+            cy = tree.y0 + j[enclosed]*tree.finestCellSize + h/2
+            index = EdgeIndex(polygons)
+            votes = sum(index.containsPoints(cx + ox*h/2, cy + oy*h/2).astype(int)
+                        for ox, oy in [(1, 0), (0, 1), (-1, 0), (0, -1)])
+            solidArea[enclosed] += numpy.where(votes > 2, h**2, 0)
+
+        self.fluidFraction = numpy.where(solid, 0.0, 1.0)
+        self.fluidFraction[self.isCut] = 1 - solidArea[self.isCut]/(sizes[self.isCut]**2)
+        self.faceFractions = numpy.repeat(self.fluidFraction[:, None], 4, axis=1)
+        self.faceFractions[self.isCut] = 1 - covered[self.isCut]/sizes[self.isCut, None]
+        # Rounding can take cells that are almost all fluid or all solid just past the ends of the range.
+        numpy.clip(self.fluidFraction, 0, 1, out=self.fluidFraction)
+        numpy.clip(self.faceFractions, 0, 1, out=self.faceFractions)
+        self.wallLength = wallLength
+
+        normalLength = numpy.hypot(wallX, wallY)
+        normalLength[normalLength == 0] = 1
+        self.wallNormalX = wallX/normalLength
+        self.wallNormalY = wallY/normalLength
+
+
+    @staticmethod
+    def addPolygon(tree, polygon, solidArea, covered, wallX, wallY, wallLength, crossed):
+        '''
+        Adds the solid area, covered face lengths and wall of one polygon to the running totals for each leaf, and
+        marks the leaves whose edges the polygon crosses.
+        '''
+        # Everything below assumes each loop of the polygon has the solid on its left.
+        x0, y0, x1, y1 = orientedEdgeArrays(polygon)
+        if len(x0) == 0:
+            return
+
+        cellLists = [tree.leafIndicesAlongSegment(x0[k], y0[k], x1[k], y1[k]) for k in range(len(x0))]
+        counts = numpy.array([len(c) for c in cellLists])
+        if counts.sum() == 0:
+            return
+        cells = numpy.concatenate(cellLists)
+        lines = numpy.repeat(numpy.arange(len(x0)), counts)
+
+        # Work relative to the center of each cell.
+        i, j = mortonDecode(tree.codes[cells])
+        h = tree.maxCellSize/numpy.left_shift(1, tree.levels[cells].astype(numpy.int64))
+        cx = tree.x0 + i*tree.finestCellSize + h/2
+        cy = tree.y0 + j*tree.finestCellSize + h/2
+        ax = x0[lines] - cx
+        ay = y0[lines] - cy
+        dx = x1[lines] - x0[lines]
+        dy = y1[lines] - y0[lines]
+        half = h/2
+
+        # Clip each side to its cell (Liang-Barsky).
+        t0 = numpy.zeros(len(cells))
+        t1 = numpy.ones(len(cells))
+        inside = numpy.ones(len(cells), dtype=bool)
+        for p, q in [(-dx, ax + half), (dx, half - ax), (-dy, ay + half), (dy, half - ay)]:
+            parallel = p == 0
+            inside &= ~(parallel & (q < 0))
+            r = numpy.where(parallel, 0, q/numpy.where(parallel, 1, p))
+            t0 = numpy.where(~parallel & (p < 0), numpy.maximum(t0, r), t0)
+            t1 = numpy.where(~parallel & (p > 0), numpy.minimum(t1, r), t1)
+        inside &= t0 < t1
+
+        cells, h, half = cells[inside], h[inside], half[inside]
+        startX = ax[inside] + t0[inside]*dx[inside]
+        startY = ay[inside] + t0[inside]*dy[inside]
+        endX = ax[inside] + t1[inside]*dx[inside]
+        endY = ay[inside] + t1[inside]*dy[inside]
+
+        # The wall, with the normal pointing out of the solid (to the right of the direction of travel).
+        segX = endX - startX
+        segY = endY - startY
+        numpy.add.at(wallLength, cells, numpy.hypot(segX, segY))
+        numpy.add.at(wallX, cells, segY)
+        numpy.add.at(wallY, cells, -segX)
+
+        # The polygon enters a cell where a clipped piece starts on the edge of the cell, and leaves where one ends.
+        # Slivers left over from a vertex sitting just off the edge of a cell would count as both, so are ignored.
+        tolerance = 1e-9*h
+        significant = numpy.hypot(segX, segY) > tolerance
+        entering = significant & (_distanceToEdge(startX, startY, half) <= tolerance)
+        leaving = significant & (_distanceToEdge(endX, endY, half) <= tolerance)
+        crossingCells = numpy.concatenate([cells[entering], cells[leaving]])
+        crossingS = numpy.concatenate([_perimeterPosition(startX[entering], startY[entering], half[entering]),
+                                       _perimeterPosition(endX[leaving], endY[leaving], half[leaving])])
+        isEntry = numpy.concatenate([numpy.ones(entering.sum(), dtype=bool), numpy.zeros(leaving.sum(), dtype=bool)])
+        perimeter = numpy.concatenate([4*h[entering], 4*h[leaving]])
+
+        # Green's theorem: the area is the integral of x dy around the solid part of the cell. Along the wall this
+        # is added up piece by piece. Across the top and bottom faces dy is zero, and the right and left faces are
+        # at x = +h/2 and x = -h/2 relative to the center, so they're added once the covered lengths are known.
+        numpy.add.at(solidArea, cells, 0.5*(startX + endX)*(endY - startY))
+        if len(crossingCells) == 0:
+            return
+
+        # The face is covered by solid from each point where the polygon leaves, anticlockwise round to the next
+        # point where it enters. Where they coincide, the leaving point is taken first.
+        order = numpy.lexsort((isEntry, crossingS, crossingCells))
+        crossingCells, crossingS = crossingCells[order], crossingS[order]
+        isEntry, perimeter = isEntry[order], perimeter[order]
+
+        # A vertex within the tolerance of the edge of a cell, but not exactly on it, looks like the polygon leaving
+        # the cell and coming straight back in at the same point. That covers nothing, but the pair would take the
+        # place of the real crossings next to it, so it's dropped before the rest are paired up.
+        keep = ~_touchingCrossings(crossingCells, crossingS, isEntry, perimeter)
+        crossingCells, crossingS = crossingCells[keep], crossingS[keep]
+        isEntry, perimeter = isEntry[keep], perimeter[keep]
+        if len(crossingCells) == 0:
+            return
+        crossed[crossingCells] = True
+
+        positions = numpy.arange(len(crossingCells))
+        firstOfCell = numpy.r_[True, crossingCells[1:] != crossingCells[:-1]]
+        lastOfCell = numpy.r_[firstOfCell[1:], True]
+        cellStart = numpy.maximum.accumulate(numpy.where(firstOfCell, positions, 0))
+        following = numpy.where(lastOfCell, cellStart, positions + 1)
+
+        pairs = ~isEntry & isEntry[following]
+        start = crossingS[pairs]
+        stop = crossingS[following[pairs]]
+        stop = stop + numpy.where(stop < start, perimeter[pairs], 0)
+        pairCells = crossingCells[pairs]
+        pairH = perimeter[pairs]/4
+
+        # Measure around the perimeter from the bottom left corner: bottom, right, top then left. Stretches which
+        # wrap past the corner are caught by also checking each face one lap further round.
+        faceCover = numpy.zeros((len(pairCells), 4))
+        for side in range(4):
+            for lap in (0, 4):
+                sideStart = (side + lap)*pairH
+                overlap = numpy.minimum(stop, sideStart + pairH) - numpy.maximum(start, sideStart)
+                faceCover[:, side] += numpy.maximum(overlap, 0)
+        # Reorder to right, top, left, bottom to match the face table.
+        faceCover = faceCover[:, [1, 2, 3, 0]]
+        numpy.add.at(covered, pairCells, faceCover)
+        numpy.add.at(solidArea, pairCells, 0.5*pairH*(faceCover[:, 0] + faceCover[:, 2]))
+
+
+    def getBoundary(self, index):
+        '''
+        Returns a Boundary object describing the wall in the leaf at an index, or None if the leaf isn't cut.
+        '''
+        if not self.isCut[index]:
+            return None
+        return Boundary('wall', Point(float(self.wallNormalX[index]), float(self.wallNormalY[index])),
+                        float(self.wallLength[index]))
+
+
+    def __repr__(self):
+        return "Cut cell geometry for "+str(int(self.isCut.sum()))+" cut cells."
+
+
+
+def _touchingCrossings(cells, s, isEntry, perimeter):
+    '''
+    Takes the crossings of cell perimeters, sorted by cell and then by position "s" around the perimeter, and returns
+    a boolean array which is True for each pair of neighbouring crossings in the same cell (counting the last and 
+    first of a cell as neighbours) where one leaves and the other enters at the same point.
+    '''
+    n = len(cells)
+    touching = numpy.zeros(n, dtype=bool)
+    if n < 2:
+        return touching
+    positions = numpy.arange(n)
+    firstOfCell = numpy.r_[True, cells[1:] != cells[:-1]]
+    lastOfCell = numpy.r_[firstOfCell[1:], True]
+    cellStart = numpy.maximum.accumulate(numpy.where(firstOfCell, positions, 0))
+    following = numpy.where(lastOfCell, cellStart, positions + 1)
+    gap = numpy.mod(s[following] - s, perimeter)
+    gap = numpy.minimum(gap, perimeter - gap)
+    candidates = (following != positions) & (isEntry != isEntry[following]) & (gap <= 1e-9*perimeter)
+    # A run of several such crossings is paired off from the start, so no crossing is used twice.
+    for k in numpy.nonzero(candidates)[0].tolist():
+        if not touching[k] and not touching[following[k]]:
+            touching[k] = touching[following[k]] = True
+    return touching
+
+
+def _distanceToEdge(x, y, half):
+    '''
+    Returns the distance from points inside a square cell (relative to its center) to the nearest edge of the cell.
+    '''
+    return numpy.minimum(half - numpy.abs(x), half - numpy.abs(y))
+
+
+def _perimeterPosition(x, y, half):
+    '''
+    Returns how far anticlockwise around the edge of a square cell each point (relative to the center of the cell)
+    is, starting from the bottom left corner.
+    '''
+    h = 2*half
+    distances = numpy.stack([y + half, half - x, half - y, x + half], axis=1)
+    side = numpy.argmin(distances, axis=1)
+    along = numpy.choose(side, [x + half, y + half, half - x, half - y])
+    return numpy.mod(side*h + along, 4*h)
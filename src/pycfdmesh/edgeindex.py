@@ -0,0 +1,408 @@
+'''
+This file is a part of BreezyNS - a simple, general-purpose 2D airflow calculator.
+
+Copyright (c) 2013, Brendan Gray
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+
+
+Created on 17 Oct 2026
+
+@author: AlphanumericSheepPig
+
+A module which provides an EdgeIndex, a uniform grid of buckets holding the sides of one or more polygons, so that
+questions about the polygons only need to look at the sides close to where they're asked.
+
+The buckets are numbered row by row, and the sides in each bucket are stored in compressed sparse row form, so the
+sides in all the buckets from one column to the end of a row are in one contiguous run. A ray cast in the +x
+direction from a point therefore only needs that one run, and each crossing is only counted in the bucket whose
+column it lies in, so sides which fall into several buckets are never counted twice.
+'''
+
+import numpy
+
+
+def _loopStarts(x0, y0, x1, y1):
+    '''
+    Returns a boolean array which is True for each side that starts a new loop of a polygon, i.e. the first side and
+    every side that doesn't start where the one before it ends.
+    '''
+    starts = numpy.ones(len(x0), dtype=bool)
+    starts[1:] = (x0[1:] != x1[:-1]) | (y0[1:] != y1[:-1])
+    return starts
+
+
+def polygonEdgeArrays(polygon):
+    '''
+    Returns arrays (x0, y0, x1, y1) of the start and end points of the sides of a polygon. A polygon may be made of 
+    several loops (e.g. an outline and the holes in it), each starting where the sides stop joining up. If the last
+    side of a loop doesn't end where its first side starts, a side is added to close it.
+    '''
+    x0, y0, x1, y1 = polygon.getEdgeArrays()
+    if len(x0) == 0:
+        return x0, y0, x1, y1
+    firsts = numpy.nonzero(_loopStarts(x0, y0, x1, y1))[0]
+    lasts = numpy.r_[firsts[1:] - 1, len(x0) - 1]
+    unclosed = (x1[lasts] != x0[firsts]) | (y1[lasts] != y0[firsts])
+    if unclosed.any():
+        at = lasts[unclosed] + 1
+        x0, y0, x1, y1 = (numpy.insert(x0, at, x1[lasts[unclosed]]), numpy.insert(y0, at, y1[lasts[unclosed]]),
+                          numpy.insert(x1, at, x0[firsts[unclosed]]), numpy.insert(y1, at, y0[firsts[unclosed]]))
+    return x0, y0, x1, y1
+
+
+def orientedEdgeArrays(polygon):
+    '''
+    Returns the closed sides of a polygon like polygonEdgeArrays, but with each loop turned so that the inside of the
+    polygon is on its left: outlines run anticlockwise, and holes (loops inside an odd number of other loops) run 
+    clockwise.
+    '''
+    x0, y0, x1, y1 = [numpy.array(a, dtype=float) for a in polygonEdgeArrays(polygon)]
+    if len(x0) == 0:
+        return x0, y0, x1, y1
+    loops = numpy.cumsum(_loopStarts(x0, y0, x1, y1)) - 1
+    nLoops = loops[-1] + 1
+    firsts = numpy.searchsorted(loops, numpy.arange(nLoops))
+    areas = numpy.bincount(loops, x0*y1 - x1*y0, minlength=nLoops)
+    
+    # A loop is a hole if its first corner is inside an odd number of the other loops, counting the sides crossed by
+    # a ray in the +x direction (the same rule as EdgeIndex.getInsideBodies).
+    px, py = x0[firsts][:, None], y0[firsts][:, None]
+    crosses = (((y0 <= py) & (y1 > py)) | ((y1 <= py) & (y0 > py))) & (loops != numpy.arange(nLoops)[:, None])
+    t = (py - y0)/numpy.where(y1 != y0, y1 - y0, 1)
+    crosses &= x0 + t*(x1 - x0) > px
+    isHole = crosses.sum(axis=1) % 2 == 1
+    
+    for loop in numpy.nonzero((areas > 0) == isHole)[0]:
+        inLoop = loops == loop
+        x0[inLoop], y0[inLoop], x1[inLoop], y1[inLoop] = (x1[inLoop][::-1], y1[inLoop][::-1], 
+                                                          x0[inLoop][::-1], y0[inLoop][::-1])
+    return x0, y0, x1, y1
+
+
+
+class EdgeIndex():
+    '''
+    A uniform grid index over the sides of a list of polygons (bodies). Each side is put in every bucket that its
+    bounding box overlaps. A body may be made of several loops, and a point is inside it if it's inside an odd number
+    of them (the even-odd rule), so a loop inside another is a hole whichever way round it runs. The sides are 
+    stored as arrays:
+        EdgeIndex.x0, EdgeIndex.y0, EdgeIndex.x1 and EdgeIndex.y1 hold the end points of each side.
+        EdgeIndex.body holds the index in the list of polygons of the polygon that each side belongs to.
+    '''
+
+    def __init__(self, polygons, bucketSize = None):
+        '''
+        Builds the index for a list of polygons. If "bucketSize" isn't given, it's chosen from the average length of
+        the sides, so that each bucket holds only a few of them.
+        '''
+        self.nBodies = len(polygons)
+        edges = [polygonEdgeArrays(polygon) for polygon in polygons]
+        self.x0, self.y0, self.x1, self.y1 = [numpy.concatenate([e[k] for e in edges] + [numpy.zeros(0)])
+                                              for k in range(4)]
+        self.body = numpy.repeat(numpy.arange(self.nBodies), [len(e[0]) for e in edges])
+        self._buildBuckets(bucketSize)
+
+
+    @classmethod
+    def fromEdgeArrays(cls, x0, y0, x1, y1, body, nBodies, bucketSize = None):
+        '''
+        Builds an index over sides that have already been taken from the polygons (e.g. with polygonEdgeArrays), 
+        where "body" gives the index of the body each side belongs to. The sides may be any subset of the sides of 
+        the bodies, as long as they include every side that a ray cast from a point being tested could cross.
+        '''
+        index = cls.__new__(cls)
+        index.nBodies = nBodies
+        index.x0, index.y0, index.x1, index.y1 = [numpy.asarray(a, dtype=float) for a in (x0, y0, x1, y1)]
+        index.body = numpy.asarray(body, dtype=numpy.int64)
+        index._buildBuckets(bucketSize)
+        return index
+
+
+    def _buildBuckets(self, bucketSize):
+        '''
+        Puts each side into the buckets its bounding box overlaps.
+        '''
+        nEdges = len(self.x0)
+        if nEdges == 0:
+            self.left, self.bottom = 0.0, 0.0
+            self.bucketSize = 1.0
+            self.nColumns, self.nRows = 1, 1
+            self.bucketEdges = numpy.zeros(0, dtype=numpy.int64)
+            self.bucketColumns = numpy.zeros(0, dtype=numpy.int64)
+            self.bucketOffsets = numpy.zeros(2, dtype=numpy.int64)
+            self.columnMajorBuckets = None
+            return
+
+        minX = numpy.minimum(self.x0, self.x1)
+        maxX = numpy.maximum(self.x0, self.x1)
+        minY = numpy.minimum(self.y0, self.y1)
+        maxY = numpy.maximum(self.y0, self.y1)
+        self.left, self.bottom = minX.min(), minY.min()
+        width, height = maxX.max() - self.left, maxY.max() - self.bottom
+
+        if bucketSize is None:
+            bucketSize = 2*numpy.hypot(maxX - minX, maxY - minY).mean()
+            # Don't let the grid get much bigger than the number of sides, e.g. for a few long sides far apart.
+            bucketSize = max(bucketSize, numpy.sqrt(width*height/(4*nEdges)))
+        if bucketSize <= 0:
+            bucketSize = max(width, height, 1.0)
+        self.bucketSize = float(bucketSize)
+        self.nColumns = int(width//self.bucketSize) + 1
+        self.nRows = int(height//self.bucketSize) + 1
+
+        firstColumn, firstRow = self.bucketCoords(minX, minY)
+        lastColumn, lastRow = self.bucketCoords(maxX, maxY)
+
+        # Expand each side into one (bucket, side) pair for every bucket its bounding box covers.
+        columns = lastColumn - firstColumn + 1
+        counts = columns*(lastRow - firstRow + 1)
+        edges = numpy.repeat(numpy.arange(nEdges), counts)
+        within = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        column = firstColumn[edges] + within % columns[edges]
+        row = firstRow[edges] + within // columns[edges]
+        buckets = row*self.nColumns + column
+
+        order = numpy.argsort(buckets, kind='stable')
+        self.bucketEdges = edges[order]
+        self.bucketColumns = column[order]
+        self.bucketOffsets = numpy.zeros(self.nColumns*self.nRows + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(buckets, minlength=self.nColumns*self.nRows), out=self.bucketOffsets[1:])
+        self.columnMajorBuckets = None
+
+
+    def nEdges(self):
+        return len(self.x0)
+
+
+    def bucketCoords(self, x, y):
+        '''
+        Returns arrays (column, row) of the buckets containing the points (x, y), clipped to the edge of the grid.
+        '''
+        column = numpy.floor((numpy.asarray(x, dtype=float) - self.left)/self.bucketSize).astype(numpy.int64)
+        row = numpy.floor((numpy.asarray(y, dtype=float) - self.bottom)/self.bucketSize).astype(numpy.int64)
+        return numpy.clip(column, 0, self.nColumns - 1), numpy.clip(row, 0, self.nRows - 1)
+
+
+    def _candidatePairs(self, starts, stops):
+        '''
+        Returns arrays (queries, slots) listing every position in bucketEdges[starts[n]:stops[n]] against query n.
+        '''
+        counts = numpy.maximum(stops - starts, 0)
+        queries = numpy.repeat(numpy.arange(len(starts)), counts)
+        positions = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        return queries, starts[queries] + positions
+
+
+    def getInsideBodies(self, xs, ys):
+        '''
+        Returns a boolean array of shape (len(xs), nBodies), which is True where a point is inside a body by the 
+        even-odd rule: the sides of each body crossed by a ray in the +x direction are counted (with the same 
+        crossing test as Polygon.containsPoints), and the point is inside if the count is odd. The direction the 
+        sides run in makes no difference, so this is not a winding number. All the points are tested in one pass.
+        '''
+        xs = numpy.asarray(xs, dtype=float).ravel()
+        ys = numpy.asarray(ys, dtype=float).ravel()
+        inside = numpy.zeros((len(xs), self.nBodies), dtype=bool)
+        if self.nEdges() == 0:
+            return inside
+
+        column, row = self.bucketCoords(xs, ys)
+        inGrid = (ys >= self.bottom) & (ys <= self.bottom + self.nRows*self.bucketSize)
+        starts = self.bucketOffsets[row*self.nColumns + column]
+        stops = numpy.where(inGrid, self.bucketOffsets[(row + 1)*self.nColumns], starts)
+        points, slots = self._candidatePairs(starts, stops)
+        edges = self.bucketEdges[slots]
+
+        px, py = xs[points], ys[points]
+        x0, y0, x1, y1 = self.x0[edges], self.y0[edges], self.x1[edges], self.y1[edges]
+        # The same crossing test as Polygon.containsPoints, but only counting each crossing in the bucket whose column
+        # it lies in.
+        side = (x1 - x0)*(py - y0) - (px - x0)*(y1 - y0)
+        upward = (y0 <= py) & (y1 > py) & (side > 0)
+        downward = (y1 <= py) & (y0 > py) & (side < 0)
+        crosses = upward | downward
+        t = (py - y0)/numpy.where(crosses, y1 - y0, 1)
+        crossingX = numpy.clip(x0 + t*(x1 - x0), numpy.minimum(x0, x1), numpy.maximum(x0, x1))
+        counted = crosses & (self.bucketCoords(crossingX, py)[0] == self.bucketColumns[slots])
+
+        crossings = numpy.zeros((len(xs), self.nBodies), dtype=numpy.int64)
+        numpy.add.at(crossings, (points[counted], self.body[edges[counted]]), 1)
+        return crossings % 2 == 1
+
+
+    def containsPoints(self, xs, ys):
+        '''
+        Returns a boolean array which is True where a point (xs, ys) is inside any of the bodies, each by the 
+        even-odd rule of getInsideBodies.
+        '''
+        return self.getInsideBodies(xs, ys).any(axis=1)
+
+
+    def _bucketRuns(self, queries, lines, first, last, byColumn = False):
+        '''
+        Takes runs of buckets, each belonging to a query, and returns arrays (queries, edges) listing every side in
+        each run. Each run covers the buckets from "first" to "last" along one row, or along one column if "byColumn"
+        is True. Runs outside the grid are skipped, and the rest are clipped to it.
+        '''
+        if byColumn:
+            edges, offsets = self._getColumnMajorBuckets()
+            nLines, length = self.nColumns, self.nRows
+        else:
+            edges, offsets = self.bucketEdges, self.bucketOffsets
+            nLines, length = self.nRows, self.nColumns
+        valid = (lines >= 0) & (lines < nLines) & (last >= 0) & (first < length)
+        queries, lines = queries[valid], lines[valid]
+        first = numpy.maximum(first[valid], 0)
+        last = numpy.minimum(last[valid], length - 1)
+        # Along a row (or column), the buckets from one to another are one contiguous run.
+        starts = offsets[lines*length + first]
+        stops = offsets[lines*length + last + 1]
+        runs, slots = self._candidatePairs(starts, stops)
+        return queries[runs], edges[slots]
+
+
+    def _getColumnMajorBuckets(self):
+        '''
+        Returns the buckets numbered column by column instead of row by row, as arrays (edges, offsets) in the same 
+        form as bucketEdges and bucketOffsets. They're only built the first time they're needed.
+        '''
+        if self.columnMajorBuckets is None:
+            counts = numpy.diff(self.bucketOffsets)
+            buckets = numpy.repeat(numpy.arange(len(counts)), counts)
+            columnMajor = (buckets % self.nColumns)*self.nRows + buckets//self.nColumns
+            order = numpy.argsort(columnMajor, kind='stable')
+            offsets = numpy.zeros(len(counts) + 1, dtype=numpy.int64)
+            numpy.cumsum(numpy.bincount(columnMajor, minlength=len(counts)), out=offsets[1:])
+            self.columnMajorBuckets = (self.bucketEdges[order], offsets)
+        return self.columnMajorBuckets
+
+
+    def getEdgesNearBox(self, left, bottom, right, top):
+        '''
+        Returns a sorted array of the sides which might touch the box, i.e. those in any bucket the box overlaps.
+        '''
+        if (self.nEdges() == 0 or right < self.left or top < self.bottom or 
+            left > self.left + self.nColumns*self.bucketSize or bottom > self.bottom + self.nRows*self.bucketSize):
+            return numpy.zeros(0, dtype=numpy.int64)
+        firstColumn, firstRow = self.bucketCoords(left, bottom)
+        lastColumn, lastRow = self.bucketCoords(right, top)
+        rows = numpy.arange(firstRow, lastRow + 1)
+        edges = self._bucketRuns(numpy.zeros(len(rows), dtype=numpy.int64), rows, 
+                                 numpy.full(len(rows), firstColumn), numpy.full(len(rows), lastColumn))[1]
+        return numpy.unique(edges)
+
+
+    def getIntersectingEdges(self, x0, y0, x1, y1):
+        '''
+        Returns a sorted array of the sides which intersect (or touch) the segment from (x0, y0) to (x1, y1).
+        '''
+        edges = self.getEdgesNearBox(min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+        ex0, ey0, ex1, ey1 = self.x0[edges], self.y0[edges], self.x1[edges], self.y1[edges]
+        d1 = (ex1 - ex0)*(y0 - ey0) - (x0 - ex0)*(ey1 - ey0)
+        d2 = (ex1 - ex0)*(y1 - ey0) - (x1 - ex0)*(ey1 - ey0)
+        d3 = (x1 - x0)*(ey0 - y0) - (ex0 - x0)*(y1 - y0)
+        d4 = (x1 - x0)*(ey1 - y0) - (ex1 - x0)*(y1 - y0)
+        crossing = (d1*d2 < 0) & (d3*d4 < 0)
+        # Otherwise they only meet if an end point of one lies on the other.
+        touching = (((d1 == 0) & _inBox(x0, y0, ex0, ey0, ex1, ey1)) | ((d2 == 0) & _inBox(x1, y1, ex0, ey0, ex1, ey1)) |
+                    ((d3 == 0) & _inBox(ex0, ey0, x0, y0, x1, y1)) | ((d4 == 0) & _inBox(ex1, ey1, x0, y0, x1, y1)))
+        return edges[crossing | touching]
+
+
+    def getNearestEdges(self, xs, ys, maxDistance = None):
+        '''
+        Returns arrays (edges, distances) giving the nearest side to each point (xs, ys) and the distance to it. The 
+        search starts in the bucket holding each point and works outwards one ring of buckets at a time, stopping as
+        soon as nothing further out could be any closer. If "maxDistance" is given, the search also stops there, and
+        points with no side that close get an edge of -1 and a distance of infinity.
+        
+        This is quickest for points near the sides. Points far from every side have to search many empty rings.
+        '''
+        xs = numpy.asarray(xs, dtype=float).ravel()
+        ys = numpy.asarray(ys, dtype=float).ravel()
+        nearest = numpy.full(len(xs), -1, dtype=numpy.int64)
+        distances = numpy.full(len(xs), numpy.inf)
+        if self.nEdges() == 0:
+            return nearest, distances
+
+        column, row = self.bucketCoords(xs, ys)
+        searching = numpy.arange(len(xs))
+        ring = 0
+        while len(searching) > 0:
+            # The ring of buckets "ring" steps from the point's bucket: rows along the top and bottom, and columns
+            # down each side.
+            c, r = column[searching], row[searching]
+            if ring == 0:
+                points, edges = self._bucketRuns(searching, r, c, c)
+            else:
+                rowPoints, rowEdges = self._bucketRuns(numpy.concatenate([searching, searching]), 
+                                                       numpy.concatenate([r - ring, r + ring]), 
+                                                       numpy.concatenate([c - ring, c - ring]), 
+                                                       numpy.concatenate([c + ring, c + ring]))
+                columnPoints, columnEdges = self._bucketRuns(numpy.concatenate([searching, searching]), 
+                                                             numpy.concatenate([c - ring, c + ring]), 
+                                                             numpy.concatenate([r - ring + 1, r - ring + 1]), 
+                                                             numpy.concatenate([r + ring - 1, r + ring - 1]), 
+                                                             byColumn=True)
+                points = numpy.concatenate([rowPoints, columnPoints])
+                edges = numpy.concatenate([rowEdges, columnEdges])
+            if len(points) > 0:
+                d = _distanceToSegments(xs[points], ys[points], self.x0[edges], self.y0[edges], self.x1[edges], 
+                                        self.y1[edges])
+                # Keep the closest side found for each point.
+                order = numpy.lexsort((d, points))
+                first = numpy.r_[True, points[order][1:] != points[order][:-1]]
+                best = order[first]
+                closer = d[best] < distances[points[best]]
+                nearest[points[best[closer]]] = edges[best[closer]]
+                distances[points[best[closer]]] = d[best[closer]]
+
+            # Any side not searched yet is at least "ring" buckets away from the point.
+            if ring >= max(self.nColumns, self.nRows):
+                break
+            if maxDistance is not None and ring*self.bucketSize >= maxDistance:
+                break
+            searching = searching[distances[searching] > ring*self.bucketSize]
+            ring += 1
+        
+        if maxDistance is not None:
+            tooFar = distances > maxDistance
+            nearest[tooFar] = -1
+            distances[tooFar] = numpy.inf
+        return nearest, distances
+
+
+    def __repr__(self):
+        return ("Edge index of "+str(self.nEdges())+" sides of "+str(self.nBodies)+" bodies in "+
+                str(self.nColumns)+" x "+str(self.nRows)+" buckets.")
+
+
+
+def _distanceToSegments(px, py, x0, y0, x1, y1):
+    '''
+    Returns the distance from each point (px, py) to the matching segment from (x0, y0) to (x1, y1).
+    '''
+    dx = x1 - x0
+    dy = y1 - y0
+    lengthSquared = dx*dx + dy*dy
+    t = ((px - x0)*dx + (py - y0)*dy)/numpy.where(lengthSquared > 0, lengthSquared, 1)
+    t = numpy.clip(t, 0, 1)
+    return numpy.hypot(x0 + t*dx - px, y0 + t*dy - py)
+
+
+def _inBox(px, py, ax, ay, bx, by):
+    '''
+    Returns True where the point (px, py) lies in the box with opposite corners (ax, ay) and (bx, by).
+    '''
+    return ((px >= numpy.minimum(ax, bx)) & (px <= numpy.maximum(ax, bx)) & 
+            (py >= numpy.minimum(ay, by)) & (py <= numpy.maximum(ay, by)))
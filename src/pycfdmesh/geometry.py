@@ -22,10 +22,23 @@ Created on 26 Nov 2013
 
 import math
 import copy
+import numpy
 from pycfdalg.usefulstuff import floatRange
+from pycfdmesh.edgeindex import EdgeIndex
+
+
+def _orientation(a, b, c):
+    '''
+    Returns twice the signed area of the triangle abc, which is positive if c is to the left of the line from a to
+    b, negative if it's to the right, and zero if the three points are in line.
+    '''
+    return (b.x - a.x)*(c.y - a.y) - (c.x - a.x)*(b.y - a.y)
+
 
 
 class Point():
+    
+    __slots__ = ('x', 'y')
 
     def __init__(self, x, y):
         self.x = x
@@ -63,6 +76,10 @@ class Point():
 
 class BoundingBox():
     
+    # Bounding boxes are created for every cell in the mesh, so they only store what they need. The edges are 
+    # worked out from the center when they're asked for.
+    __slots__ = ('center', 'halfWidth', 'halfHeight')
+    
     def __init__(self, center, halfWidth, halfHeight = None):
         self.center = center
         self.halfWidth = halfWidth
@@ -70,13 +87,25 @@ class BoundingBox():
             self.halfHeight = halfWidth
         else:
             self.halfHeight = halfHeight
-        self.left = center.x - self.halfWidth
-        self.right = center.x + self.halfWidth
-        self.top = center.y + self.halfHeight
-        self.bottom = center.y - self.halfHeight
-         
+    
+    @property
+    def left(self):
+        return self.center.x - self.halfWidth
+    
+    @property
+    def right(self):
+        return self.center.x + self.halfWidth
+    
+    @property
+    def top(self):
+        return self.center.y + self.halfHeight
+    
+    @property
+    def bottom(self):
+        return self.center.y - self.halfHeight
         
         
+
     def containsPoint(self, point):
         if abs(point.x - self.center.x) <= self.halfWidth:
             if abs(point.y - self.center.y) <= self.halfHeight:
@@ -99,7 +128,6 @@ class BoundingBox():
     def getPolygon(self):
         p = Polygon()
         p.createFromPointList(self.getPointList())
-        print("Creating from point list:",p)
         return p
     
     def __add__(self, other):
@@ -167,6 +195,48 @@ class PointList():
             combined.addPoint(p)
         return combined
     
+
+
+
+class ArrayPointList(PointList):
+    '''
+    A PointList which keeps its coordinates in two numpy arrays, ArrayPointList.xs and ArrayPointList.ys, instead of
+    in a list of Point objects. getXs and getYs return the arrays themselves rather than copies.
+    '''
+    
+    def __init__(self, xs = (), ys = ()):
+        self.xs = numpy.asarray(xs, dtype=float)
+        self.ys = numpy.asarray(ys, dtype=float)
+    
+    @classmethod
+    def fromPointList(cls, pointList):
+        if isinstance(pointList, ArrayPointList):
+            return cls(pointList.xs, pointList.ys)
+        return cls(pointList.getXs(), pointList.getYs())
+    
+    @property
+    def points(self):
+        ''' A list of Point objects, built each time it's asked for. '''
+        return [Point(x, y) for x, y in zip(self.xs.tolist(), self.ys.tolist())]
+    
+    def addPoint(self, point):
+        self.xs = numpy.append(self.xs, point.x)
+        self.ys = numpy.append(self.ys, point.y)
+    
+    def getXs(self):
+        return self.xs
+    
+    def getYs(self):
+        return self.ys
+    
+    def length(self):
+        return len(self.xs)
+    
+    def __add__(self, other):
+        ''' Concatenation of two PointLists '''
+        other = ArrayPointList.fromPointList(other)
+        return ArrayPointList(numpy.concatenate([self.xs, other.xs]), numpy.concatenate([self.ys, other.ys]))
+    
         
 
 class CubicBezier():
@@ -292,6 +362,43 @@ class CubicBezier():
         return "Bezier: "+str(self.p0)+" "+str(self.p1)+" "+str(self.p2)+" "+str(self.p3)
 
 
+def flattenCubicBeziers(xs, ys, tolerance):
+    '''
+    Flattens a batch of cubic Bezier curves into straight line segments, none of which strays further than 
+    "tolerance" from its curve. "xs" and "ys" have shape (n, 4), and hold the x and y coordinates of the start point, 
+    both control points and end point of each curve. Returns arrays (startXs, startYs, endXs, endYs) of the 
+    segments, in order along each curve, one curve after the other.
+    
+    Splitting a curve into m equal steps in t, the distance between each step's chord and the curve is at most 
+    max|B''|/(8m^2), and |B''| is never more than 6 times the longest second difference of the control points. So 
+    the number of steps needed is known before any points are worked out, and every point on every curve is then 
+    found at once from one matrix of Bernstein polynomials.
+    '''
+    xs = numpy.asarray(xs, dtype=float).reshape(-1, 4)
+    ys = numpy.asarray(ys, dtype=float).reshape(-1, 4)
+    if len(xs) == 0:
+        return tuple(numpy.zeros(0) for k in range(4))
+    
+    secondDifference = numpy.maximum(numpy.hypot(xs[:, 0] - 2*xs[:, 1] + xs[:, 2], ys[:, 0] - 2*ys[:, 1] + ys[:, 2]),
+                                     numpy.hypot(xs[:, 1] - 2*xs[:, 2] + xs[:, 3], ys[:, 1] - 2*ys[:, 2] + ys[:, 3]))
+    steps = numpy.maximum(numpy.ceil(numpy.sqrt(0.75*secondDifference/tolerance)), 1).astype(numpy.int64)
+    
+    # Points t = 0, 1/m, ..., 1 along each curve.
+    nPoints = steps + 1
+    curve = numpy.repeat(numpy.arange(len(xs)), nPoints)
+    k = numpy.arange(nPoints.sum()) - numpy.repeat(numpy.cumsum(nPoints) - nPoints, nPoints)
+    t = k/steps[curve]
+    s = 1 - t
+    bernstein = numpy.stack([s*s*s, 3*s*s*t, 3*s*t*t, t*t*t], axis=1)
+    px = numpy.einsum('ij,ij->i', bernstein, xs[curve])
+    py = numpy.einsum('ij,ij->i', bernstein, ys[curve])
+    
+    # Each point except the last on each curve starts a segment, which ends at the next point.
+    starts = numpy.nonzero(k < steps[curve])[0]
+    return px[starts], py[starts], px[starts + 1], py[starts + 1]
+
+
+
 class CurveList():
     
     def __init__(self, curveList=[]):
@@ -352,6 +459,24 @@ class CurveList():
             lineList.append(c.toLine())
         return LineList(lineList)
     
+    
+    def getControlArrays(self):
+        '''
+        Returns arrays (xs, ys) of shape (n, 4), holding the start point, control points and end point of each curve.
+        '''
+        points = [(c.p0, c.p1, c.p2, c.p3) for c in self.curves]
+        xs = numpy.array([[p.x for p in curve] for curve in points], dtype=float).reshape(-1, 4)
+        ys = numpy.array([[p.y for p in curve] for curve in points], dtype=float).reshape(-1, 4)
+        return xs, ys
+    
+    
+    def flatten(self, tolerance):
+        '''
+        Returns an ArrayLineList approximating the curves, with no line further than "tolerance" from the curve it 
+        replaces. See flattenCubicBeziers.
+        '''
+        return ArrayLineList(*flattenCubicBeziers(*self.getControlArrays(), tolerance=tolerance))
+    
         
                 
     
@@ -398,32 +523,23 @@ class StraightLine():
     
     def intersectsWith(self, other):
         '''
-        Returns True if two line segments intersect between their start and end points, and False otherwise.
+        Returns True if two line segments intersect between their start and end points (including touching), and 
+        False otherwise. Only the signs of cross products are used, so vertical and horizontal lines are handled the 
+        same as any other.
         '''
-        intersectionRegion = self.getBoundingBox() + other.getBoundingBox()
-        if not intersectionRegion:
-            return False
-        
-        m1 = (self.startPoint.y - self.endPoint.y)/(self.startPoint.x - self.endPoint.x)
-        m2 = (other.startPoint.y - other.endPoint.y)/(other.startPoint.x - other.endPoint.x)
-        c1 = self.startPoint.y - m1*self.startPoint.x
-        c2 = other.startPoint.y - m2*other.startPoint.x
-        
-        # Check degenerate case if lines are parallel
-        if m1 == m2:
-            return c1 == c2
+        d1 = _orientation(other.startPoint, other.endPoint, self.startPoint)
+        d2 = _orientation(other.startPoint, other.endPoint, self.endPoint)
+        d3 = _orientation(self.startPoint, self.endPoint, other.startPoint)
+        d4 = _orientation(self.startPoint, self.endPoint, other.endPoint)
         
-        # Otherwise there is a single intersection point. 
-        x = (c2-c1)/(m1-m2)
-        y = m1*x+c1
-        
-        intersectionPoint = Point(x, y)
-        
-        # If the line segments intersect, then the intersection point must lie within the intersection region.
-        if intersectionRegion.containsPoint(intersectionPoint):
+        if d1*d2 < 0 and d3*d4 < 0:
             return True
-        else:
-            return False
+        
+        # Otherwise the segments can only meet if an end point of one lies on the other.
+        return ((d1 == 0 and other.getBoundingBox().containsPoint(self.startPoint)) or
+                (d2 == 0 and other.getBoundingBox().containsPoint(self.endPoint)) or
+                (d3 == 0 and self.getBoundingBox().containsPoint(other.startPoint)) or
+                (d4 == 0 and self.getBoundingBox().containsPoint(other.endPoint)))
         
         
     def getBoundingBox(self):
@@ -483,6 +599,11 @@ class LineList():
         newLineList = []
         currentStart = 0
         for i in range(len(self.lines)):
+            # Lines are never merged across the gap between two loops of a polygon with holes.
+            if i > 0:
+                start, lastEnd = self.lines[i].startPoint, self.lines[i-1].endPoint
+                if start.x != lastEnd.x or start.y != lastEnd.y:
+                    currentStart = i
             startPoint = self.lines[currentStart].startPoint
             endPoint = self.lines[i].endPoint
             newLine = StraightLine(startPoint, endPoint)
@@ -491,8 +612,96 @@ class LineList():
                 currentStart = i+1
         return LineList(newLineList)
         
+    def getEdgeArrays(self):
+        '''
+        Returns arrays (startXs, startYs, endXs, endYs) of the start and end points of the lines.
+        '''
+        return (numpy.array([line.startPoint.x for line in self.lines], dtype=float),
+                numpy.array([line.startPoint.y for line in self.lines], dtype=float),
+                numpy.array([line.endPoint.x for line in self.lines], dtype=float),
+                numpy.array([line.endPoint.y for line in self.lines], dtype=float))
+        
     def toPolygon(self):
         return Polygon(self.lines)
+
+
+
+class ArrayLineList(LineList):
+    '''
+    A LineList which keeps the start and end points of its lines in numpy arrays (ArrayLineList.startXs, startYs, 
+    endXs and endYs) instead of in a list of StraightLine objects.
+    '''
+    
+    def __init__(self, startXs = (), startYs = (), endXs = (), endYs = ()):
+        self.startXs = numpy.asarray(startXs, dtype=float)
+        self.startYs = numpy.asarray(startYs, dtype=float)
+        self.endXs = numpy.asarray(endXs, dtype=float)
+        self.endYs = numpy.asarray(endYs, dtype=float)
+    
+    
+    @classmethod
+    def fromLineList(cls, lineList):
+        return cls(*lineList.getEdgeArrays())
+    
+    
+    @property
+    def lines(self):
+        ''' A list of StraightLine objects, built each time it's asked for. '''
+        return [StraightLine(Point(x0, y0), Point(x1, y1)) for x0, y0, x1, y1 in 
+                zip(self.startXs.tolist(), self.startYs.tolist(), self.endXs.tolist(), self.endYs.tolist())]
+    
+    
+    def getEdgeArrays(self):
+        return self.startXs, self.startYs, self.endXs, self.endYs
+    
+    
+    def getDefiningPoints(self):
+        if len(self.startXs) == 0:
+            return ArrayPointList()
+        return ArrayPointList(numpy.concatenate([self.startXs[:1], self.endXs]), 
+                              numpy.concatenate([self.startYs[:1], self.endYs]))
+    
+    
+    def createFromPointList(self, pointList):
+        pointList = ArrayPointList.fromPointList(pointList)
+        if pointList.length() < 2:
+            self.__init__()
+            return
+        self.__init__(pointList.xs[:-1], pointList.ys[:-1], pointList.xs[1:], pointList.ys[1:])
+        return self
+    
+    
+    def lengths(self):
+        return numpy.hypot(self.endXs - self.startXs, self.endYs - self.startYs)
+    
+    
+    def removeZeroLengthLines(self):
+        keep = self.lengths() > 0
+        return ArrayLineList(self.startXs[keep], self.startYs[keep], self.endXs[keep], self.endYs[keep])
+    
+    
+    def removeShortLines(self, minLength):
+        # Each kept line depends on where the last one ended, so this has to walk along the lines in order, but it 
+        # only ever touches floats.
+        startXs, startYs = self.startXs.tolist(), self.startYs.tolist()
+        endXs, endYs = self.endXs.tolist(), self.endYs.tolist()
+        starts, ends = [], []
+        currentStart = 0
+        for i in range(len(endXs)):
+            # Lines are never merged across the gap between two loops of a polygon with holes.
+            if i > 0 and (startXs[i] != endXs[i-1] or startYs[i] != endYs[i-1]):
+                currentStart = i
+            if math.hypot(endXs[i] - startXs[currentStart], endYs[i] - startYs[currentStart]) >= minLength:
+                starts.append(currentStart)
+                ends.append(i)
+                currentStart = i+1
+        starts = numpy.array(starts, dtype=numpy.int64)
+        ends = numpy.array(ends, dtype=numpy.int64)
+        return ArrayLineList(self.startXs[starts], self.startYs[starts], self.endXs[ends], self.endYs[ends])
+    
+    
+    def toPolygon(self):
+        return ArrayPolygon(self.startXs, self.startYs, self.endXs, self.endYs)
         
         
 class Polygon(LineList):
@@ -505,7 +714,9 @@ class Polygon(LineList):
     def calculateBoundingBox(self):
         '''
         This forces the bounding box to be recalculated. If the polygon hasn't changed, rather use Polygon.getBoundingBox()
+        The edge index is also thrown away, to be rebuilt the next time it's needed.
         '''
+        self.edgeIndex = None
         if len(self.lines) == 0:
             self.boundingBox = None
             return None 
@@ -538,37 +749,67 @@ class Polygon(LineList):
         return self.boundingBox
     
     
+    def getEdgeIndex(self):
+        '''
+        Returns an EdgeIndex over the sides of the polygon, which is built the first time it's needed. Like 
+        Polygon.getBoundingBox, this assumes that the polygon hasn't changed since then.
+        '''
+        if self.edgeIndex is None:
+            self.edgeIndex = EdgeIndex([self])
+        return self.edgeIndex
+    
+    
     def containsPoint(self, point):
         '''
-        Uses a simple ray casting algorithm to determine if a point lies inside a polygon. 
+        Returns True if a point lies inside the polygon. See Polygon.containsPoints.
         '''
-        self.getBoundingBox()
-        if not self.boundingBox.containsPoint(point):
-            return False
-        
-        rayStart = Point(self.boundingBox.left, point.y)
-        ray = StraightLine(rayStart, point)
+        return bool(self.containsPoints([point.x], [point.y])[0])
+    
+    
+    def containsPoints(self, xs, ys):
+        '''
+        Returns a boolean array which is True for each point (xs, ys) that lies inside the polygon, by counting the 
+        sides crossing the horizontal line through a point, to the right of the point. The point is inside if the
+        count is odd, so a polygon made of several loops has holes where one loop lies inside another. Each side 
+        includes its lower end but not its upper end, so a line through a vertex is counted once, and horizontal 
+        sides are never counted. No divisions are needed, so vertical sides are no special case.
         
-        intersectionCount = 0
-        for line in self.lines:
-            # print ("    Testing point",point,"and line",line)
-            if ray.intersectsWith(line):
-                intersectionCount += 1
-                # print ("        Intersection count", intersectionCount)
-        if intersectionCount % 2 == 1:
-            return True
-        else:
-            return False
+        Only the sides in the edge index buckets along the line to the right of each point are looked at.
+        '''
+        return self.getEdgeIndex().containsPoints(xs, ys)
+    
+    
+    def getSidesCrossing(self, line):
+        '''
+        Returns a list of the sides of the polygon which intersect (or touch) a StraightLine.
+        '''
+        index = self.getEdgeIndex()
+        edges = index.getIntersectingEdges(line.startPoint.x, line.startPoint.y, line.endPoint.x, line.endPoint.y)
+        return [StraightLine(Point(index.x0[e], index.y0[e]), Point(index.x1[e], index.y1[e])) for e in edges.tolist()]
+    
+    
+    def intersectsWith(self, line):
+        '''
+        Returns True if a StraightLine intersects (or touches) any side of the polygon.
+        '''
+        index = self.getEdgeIndex()
+        return len(index.getIntersectingEdges(line.startPoint.x, line.startPoint.y, 
+                                              line.endPoint.x, line.endPoint.y)) > 0
+    
+    
+    def distancesToPoints(self, xs, ys):
+        '''
+        Returns an array of the distance from each point (xs, ys) to the nearest side of the polygon.
+        '''
+        return self.getEdgeIndex().getNearestEdges(xs, ys)[1]
             
             
     def containsBoundingBox(self, boundingBox):
         '''
         Returns true if all four corners of the boundingBox are contained inside the polygon.
         '''
-        for point in boundingBox.getPointList().points:
-            if not self.containsPoint(point):
-                return False
-        return True
+        points = boundingBox.getPointList()
+        return bool(self.containsPoints(points.getXs(), points.getYs()).all())
         
         
         
@@ -585,4 +826,33 @@ class Polygon(LineList):
     
             
         
-        
\ No newline at end of file
+        
+
+
+
+class ArrayPolygon(ArrayLineList, Polygon):
+    '''
+    A Polygon which keeps its sides in arrays, like an ArrayLineList. Everything a Polygon can do works the same way,
+    since the tests for points and lines all go through the edge index.
+    '''
+    
+    def __init__(self, startXs = (), startYs = (), endXs = (), endYs = ()):
+        ArrayLineList.__init__(self, startXs, startYs, endXs, endYs)
+        self.calculateBoundingBox()
+    
+    
+    def calculateBoundingBox(self):
+        self.edgeIndex = None
+        if len(self.startXs) == 0:
+            self.boundingBox = None
+            return None
+        xmin = min(self.startXs.min(), self.endXs.min())
+        xmax = max(self.startXs.max(), self.endXs.max())
+        ymin = min(self.startYs.min(), self.endYs.min())
+        ymax = max(self.startYs.max(), self.endYs.max())
+        self.boundingBox = BoundingBox(Point((xmin+xmax)/2, (ymin+ymax)/2), (xmax-xmin)/2, (ymax-ymin)/2)
+        return self.boundingBox
+    
+    
+    def __repr__(self):
+        return "Polygon with "+str(len(self.startXs))+" sides."
@@ -21,109 +21,208 @@ Created on 26 Nov 2013
 '''
 
 
-import math
-from pycfdmesh.geometry import Point, BoundingBox, PointList#, Polygon
+import numpy
+from pycfdmesh.geometry import Point, BoundingBox, PointList, LineList#, Polygon
+from pycfdmesh.quadtree import LinearQuadtree, mortonEncode, mortonDecode, SOLID, CLASSIFIED, BOUNDARY
+from pycfdmesh.connectivity import FaceTable
+from pycfdmesh.arrayfile import saveArrays, loadArrays
+from pycfdmesh.cutcell import CutCellGeometry
+from pycfdmesh.edgeindex import EdgeIndex, polygonEdgeArrays
 from pycfdalg.usefulstuff import removeDuplicates
 
 
+# Identifies files written by Mesh.save
+MESH_FILE_TAG = b'BRZMESH1'
+
+
 
 class Element():
     '''
-    The Element object is a Quadtree. Each element may potentially be split into four smaller elements.
-    If the element is polled for anything, then it will return it's value only if it is a leaf. Otherwise,
-    it will poll its children instead and pass on the result. 
+    The Element object is a handle onto one cell of the Mesh's LinearQuadtree. Each element may potentially be split
+    into four smaller elements. If the element is polled for anything, then it will return it's value only if it is a
+    leaf. Otherwise, it will poll its children instead and pass on the result.
+    
+    An element is identified by its level and Morton code, which never change, so an Element remains valid after the 
+    mesh is refined. Elements are created on demand and are cheap to throw away. Two Elements referring to the same 
+    cell compare equal. Everything else about the element, including its center and bounding box, is worked out
+    from the quadtree when it is asked for.
     '''
     
-    def __init__(self, center, cellSize, maxCellSize, minCellSize, parent = None):
-        self.isLeaf = True
-        self.isSolid = None
-        self.isBoundary = False
-        self.Boundary = None
-        
-        self.parent = parent
-        self.children = []
-        
-        self.cellSize = cellSize
-        self.maxCellSize = maxCellSize
-        self.minCellSize = minCellSize
-        
-        self.center = center
-        self.boundingBox = BoundingBox(center, cellSize/2)
-        
-        # We need a simple, direction-agnostic way of storing our neighbours.
-        self.neighbours = {'up':None, 'down':None, 'left':None, 'right':None}
-        
-        #print("    Created new element at",center,"with size",cellSize)
+    __slots__ = ('mesh', 'level', 'code')
+    
+    def __init__(self, mesh, level, code):
+        self.mesh = mesh
+        self.level = level
+        self.code = code
+    
+    
+    @property
+    def cellSize(self):
+        return self.mesh.quadtree.cellSize(self.level)
+    
+    @property
+    def maxCellSize(self):
+        return self.mesh.maxCellSize
+    
+    @property
+    def minCellSize(self):
+        return self.mesh.minCellSize
+    
+    @property
+    def center(self):
+        x, y = self.mesh.quadtree.cellCenter(self.level, self.code)
+        return Point(x, y)
+    
+    @property
+    def boundingBox(self):
+        return BoundingBox(self.center, self.cellSize/2)
+    
+    
+    def leafIndex(self):
+        '''
+        Returns the index of this element in the quadtree arrays, or -1 if the element is not a leaf.
+        '''
+        return self.mesh.quadtree.leafIndex(self.level, self.code)
+    
+    
+    @property
+    def isLeaf(self):
+        return self.leafIndex() >= 0
+    
+    
+    def _getFlag(self, flag):
+        index = self.leafIndex()
+        if index < 0:
+            return False
+        return bool(self.mesh.quadtree.flags[index] & flag)
+    
+    
+    def _setFlag(self, flag, value):
+        index = self.leafIndex()
+        if index < 0:
+            raise Exception("Cannot set a flag on an element that is not a leaf.")
+        if value:
+            self.mesh.quadtree.flags[index] |= flag
+        else:
+            self.mesh.quadtree.flags[index] &= 0xFF ^ flag
+    
+    
+    @property
+    def isSolid(self):
+        '''
+        True if the element is inside a solid body, False if it isn't, and None if it has not been checked yet.
+        '''
+        if not self._getFlag(CLASSIFIED):
+            return None
+        return self._getFlag(SOLID)
+    
+    @isSolid.setter
+    def isSolid(self, value):
+        self._setFlag(CLASSIFIED, value is not None)
+        self._setFlag(SOLID, value)
+    
+    
+    @property
+    def isBoundary(self):
+        return self._getFlag(BOUNDARY)
+    
+    @isBoundary.setter
+    def isBoundary(self, value):
+        self._setFlag(BOUNDARY, value)
+    
+    
+    @property
+    def Boundary(self):
+        '''
+        A Boundary object describing the wall passing through the element, or None if there isn't one. This is only
+        available once Mesh.computeCutCells has been called, unless one has been set for the element, which takes
+        the place of the cut cell wall. Setting it to None goes back to the cut cell wall.
+        '''
+        boundary = self.mesh.boundaries.get((self.level, self.code))
+        if boundary is not None:
+            return boundary
+        cutCells = self.mesh.getCutCellGeometry()
+        index = self.leafIndex()
+        if cutCells is None or index < 0:
+            return None
+        return cutCells.getBoundary(index)
+    
+    @Boundary.setter
+    def Boundary(self, boundary):
+        if boundary is None:
+            self.mesh.boundaries.pop((self.level, self.code), None)
+        else:
+            self.mesh.boundaries[(self.level, self.code)] = boundary
+    
+    
+    @property
+    def parent(self):
+        '''
+        The element containing this one. The parent of a root element is the mesh itself.
+        '''
+        if self.level == 0:
+            return self.mesh
+        return Element(self.mesh, self.level-1, self.mesh.quadtree.parentCode(self.level, self.code))
+    
+    
+    @property
+    def children(self):
+        '''
+        A list of the four elements this element has been split into, or an empty list if it is a leaf.
+        '''
+        start, stop = self.mesh.quadtree.leafRange(self.level, self.code)
+        if stop - start == 1 and self.mesh.quadtree.levels[start] <= self.level:
+            return []
+        return [Element(self.mesh, self.level+1, c) for c in self.mesh.quadtree.childCodes(self.level, self.code)]
     
     
     def getBoundingBox(self):
         return self.boundingBox 
     
+    
     def getNeighbour(self, direction):
         '''
-        Returns the element located immediately above, by finding the element (cellSize+minCellSize)/2 away.
+        Returns the leaf element immediately adjacent to the midpoint of one of this element's sides, or None if
+        there isn't one (i.e. we're on the edge of the mesh, or the neighbour is solid).
         "direction" is a string that's either 'up', 'down', 'left' or 'right'.
         '''
-        distance = (self.cellSize+self.minCellSize)/2
-
+        tree = self.mesh.quadtree
+        span = tree.span(self.level)
+        i, j = tree.cellCoords(self.level, self.code)
+        i *= span
+        j *= span
+        
+        # The finest cell just outside the middle of the relevant side.
         if direction == 'up':
-            queryPoint = Point(0,1)
+            i, j = i + span//2, j + span
         elif direction == 'down':
-            queryPoint = Point(0,-1)
+            i, j = i + span//2, j - 1
         elif direction == 'left':
-            queryPoint = Point(-1,0)
+            i, j = i - 1, j + span//2
         elif direction == 'right':
-            queryPoint = Point(1,0)
+            i, j = i + span, j + span//2
         else:
-            # This also serves as a check to see that the direction is a valid key for the neighbour dict.
             raise Exception("Error: Cannot interpret direction given while trying to find a neighbour.")
         
-        neighbourLocation = self.center + queryPoint.scaledBy(distance)
-        
-        # If we've found a neighbour before, then we can save time by querying them directly to see if it's changed.
-        # If we don't have a neighbour yet, we'll ask our parent if they can find our neighbour for us.
-        if self.neighbours[direction]:
-            self.neighbours[direction] = self.neighbours[direction].getElementAtPoint(neighbourLocation)
-            return self.neighbours[direction]
-        else:
-            self.neighbours[direction] = self.parent.getElementAtPoint(neighbourLocation)
-            return self.neighbours[direction]
+        if i < 0 or j < 0 or i >= tree.finestHorizontalCount or j >= tree.finestVerticalCount:
+            return None
+        return self.mesh.getLeafElement(tree.leafIndexAtFinestCoords(i, j))
         
         
     def getAllElements(self):
         '''
         Returns a list of all leaf elements within the current element.
         '''
-        if self.isLeaf:
-            if self.isSolid:
-                return []
-            return [self]
-        else:
-            elementList = []
-            for c in self.children:
-                elementList += c.getAllElements()
-            return elementList
+        start, stop = self.mesh.quadtree.leafRange(self.level, self.code)
+        return self.mesh.getLeafElements(start, stop)
             
     
     def getElementAtPoint(self, point):
         '''
         Gets the leaf element that contains a point.
         '''
-        # Start of by checking if this element contains the point. If not, there's no need to go further, but
-        # presumably, some element somewhere needs an answer. So, we ask the parent to find it for us.
-        if not self.boundingBox.containsPoint(point):
-            return self.parent.getElementAtPoint(point)
-            
-        if self.isLeaf:
-            if self.isSolid:
-                return None
-            return self
-        else:
-            for child in self.children:
-                # We MUST ensure that we only poll the child that definitely contains the point, otherwise
-                # it will poll it's parent (this instance), which will poll the child again, and so on.
-                if child.boundingBox.containsPoint(point):
-                    return child.getElementAtPoint(point)
+        # Since every cell knows its place in the whole mesh, there's no need to walk up through the parents first.
+        return self.mesh.getElementAtPoint(point)
         
     
     def getPointList(self):
@@ -131,47 +230,24 @@ class Element():
         If its a leaf, this returns the points defining the corners of the cell. Otherwise, it 
         returns a list of points for all of its children.
         '''
-        if self.isLeaf:
-            if self.isSolid:
-                return PointList()
-            return self.boundingBox.getPointList()
-        else:
-            pointList = PointList()
-            for child in self.children:
-                pointList += child.getPointList()
-            return pointList
+        pointList = PointList()
+        for e in self.getAllElements():
+            pointList += e.boundingBox.getPointList()
+        return pointList
     
     
     def getPolygons(self):
         '''
         Returns a list of Polygon objects defining each leaf element.
         '''
-        if self.isLeaf:
-            if self.isSolid:
-                return []
-            return [self.boundingBox.getPolygon()]
-        else:
-            polyList = []
-            for child in self.children:
-                polyList += child.getPolygons()
-            return polyList
+        return [e.boundingBox.getPolygon() for e in self.getAllElements()]
         
             
     def split(self):
-        if self.isLeaf:
-            newCellSize = self.cellSize/2
-            if newCellSize > self.minCellSize:
-                self.isLeaf = False
-                topLeft     = Point(self.center.x - newCellSize/2, self.center.y + newCellSize/2)
-                topRight    = Point(self.center.x + newCellSize/2, self.center.y + newCellSize/2) 
-                bottomRight = Point(self.center.x + newCellSize/2, self.center.y - newCellSize/2)
-                bottomLeft  = Point(self.center.x - newCellSize/2, self.center.y - newCellSize/2)
-                self.children.append(Element(topLeft, newCellSize, self.maxCellSize, self.minCellSize, self))
-                self.children.append(Element(topRight, newCellSize, self.maxCellSize, self.minCellSize, self))
-                self.children.append(Element(bottomRight, newCellSize, self.maxCellSize, self.minCellSize, self))
-                self.children.append(Element(bottomLeft, newCellSize, self.maxCellSize, self.minCellSize, self))
-                for c in self.children:
-                    c.fixNeighbourCellSizes()
+        index = self.leafIndex()
+        if index >= 0 and self.level < self.mesh.quadtree.maxLevel:
+            self.mesh.quadtree.split([index])
+            self.mesh.quadtree.balance()
     
     
     def getNeighbours(self):
@@ -192,12 +268,21 @@ class Element():
         
         for d in directions:
             n = self.getNeighbour(d)
-            if n: # There won't be any neighbour on the edge.
-                #print ("Checking",n, "since it's a neighbour of",self)
-                while self.isLeaf and n.cellSize > 2*self.cellSize: 
-                    #print ("    ",n,"is too large.")
-                    n.split()
-                    n = self.getNeighbour(d)
+            # There won't be any neighbour on the edge.
+            while n and self.isLeaf and n.cellSize > 2*self.cellSize: 
+                n.split()
+                n = self.getNeighbour(d)
+                    
+    
+    def __eq__(self, other):
+        return isinstance(other, Element) and self.mesh is other.mesh \
+            and self.level == other.level and self.code == other.code
+    
+    def __ne__(self, other):
+        return not self == other
+    
+    def __hash__(self):
+        return hash((self.level, self.code))
                     
                     
     def __repr__(self):
@@ -217,9 +302,10 @@ class Element():
     
 class Mesh():
     '''
-    The mesh object contains a uniform cartesian grid of the largest possible cell size.
+    The mesh object contains a uniform cartesian grid of the largest possible cell size, each of which may be refined
+    as a quadtree. The cells are stored in "Mesh.quadtree", a LinearQuadtree.
     "Mesh.elements" contains a list of the root Elements.
-    The (i,j)th root element, is given by "Mesh.elements[j*horizontalCellCount+i]".
+    The (i,j)th root element, is given by "Mesh.elements[i*verticalCellCount+j]".
     '''
 
     def __init__(self, bottomLeft, horizontalCellCount, verticalCellCount, maxCellSize, minCellSize):
@@ -232,11 +318,13 @@ class Mesh():
         self.maxCellSize = maxCellSize
         self.minCellSize = minCellSize
         
+        self.quadtree = LinearQuadtree(bottomLeft, horizontalCellCount, verticalCellCount, maxCellSize, minCellSize)
+        
         elements = []
         for i in range(horizontalCellCount):
             for j in range(verticalCellCount):
-                center = bottomLeft + Point(maxCellSize/2 + i*maxCellSize, maxCellSize/2 + j*maxCellSize)
-                elements.append(Element(center, maxCellSize, maxCellSize, minCellSize, self))
+                code = mortonEncode(i*self.quadtree.span(0), j*self.quadtree.span(0))
+                elements.append(Element(self, 0, code))
         self.elements = elements
         self.bottomLeft = bottomLeft
         
@@ -245,44 +333,235 @@ class Mesh():
         center = bottomLeft + Point(width, height)
         
         self.boundingBox = BoundingBox(center, width, height)
+        
+        self.faceTable = None
+        self.leafArray = None
+        self.leafArrayVersion = None
+        self.cutCellGeometry = None
+        # Boundaries set by hand on individual elements, keyed by (level, code).
+        self.boundaries = {}
+        self.curve = 'morton'
+        self.cellOrder = None
+        self.cellOrderVersion = None
+        self.orderedFaceTable = None
+    
+    
+    @property
+    def version(self):
+        '''
+        A counter which goes up every time leaves are added to or removed from the mesh. Anything worked out from
+        the leaves can be kept until the version changes.
+        '''
+        return self.quadtree.version
+    
+    
+    def getFaceTable(self):
+        '''
+        Returns a FaceTable listing every face between the leaves of the mesh. The table is built once and then
+        reused until the mesh is next refined.
+        '''
+        if self.faceTable is None or self.faceTable.version != self.quadtree.version:
+            self.faceTable = FaceTable(self.quadtree)
+        return self.faceTable
+    
+    
+    def reorder(self, curve = 'hilbert'):
+        '''
+        Numbers the leaves along a space filling curve, either 'hilbert' or 'morton', and returns the order as an 
+        array: cell n in the new numbering is leaf order[n]. The quadtree itself always stays in Morton order, but 
+        solvers can lay out their arrays in the new numbering so that cells next to each other in space are also next
+        to each other in memory. The numbering is kept up to date as the mesh changes.
+        '''
+        if curve not in ('hilbert', 'morton'):
+            raise Exception("Unknown space filling curve '"+str(curve)+"'. Use 'hilbert' or 'morton'.")
+        self.curve = curve
+        self.cellOrder = None
+        return self.getCellOrder()
+    
+    
+    def getCellOrder(self):
+        '''
+        Returns the array of leaf indices in the order set by Mesh.reorder. 
+        '''
+        if self.cellOrder is None or self.cellOrderVersion != self.version:
+            if self.curve == 'hilbert':
+                self.cellOrder = self.quadtree.hilbertOrder()
+            else:
+                self.cellOrder = numpy.arange(self.quadtree.nLeaves())
+            self.cellOrderVersion = self.version
+            self.orderedFaceTable = None
+        return self.cellOrder
+    
+    
+    def getOrderedFaceTable(self):
+        '''
+        Returns the FaceTable with its cells numbered in the order set by Mesh.reorder, and its faces sorted to 
+        match.
+        '''
+        order = self.getCellOrder()
+        if self.orderedFaceTable is None or self.orderedFaceTable.version != self.version:
+            if self.curve == 'morton':
+                self.orderedFaceTable = self.getFaceTable()
+            else:
+                self.orderedFaceTable = self.getFaceTable().renumbered(order)
+        return self.orderedFaceTable
+    
+    
+    def toCellOrder(self, values):
+        '''
+        Rearranges an array with one row per leaf (in quadtree order) into the order set by Mesh.reorder.
+        '''
+        return numpy.asarray(values)[self.getCellOrder()]
+    
+    
+    def toLeafOrder(self, values):
+        '''
+        Rearranges an array with one row per cell in the order set by Mesh.reorder back into quadtree order.
+        '''
+        values = numpy.asarray(values)
+        result = numpy.empty_like(values)
+        result[self.getCellOrder()] = values
+        return result
+    
+    
+    def save(self, filename, includeFaces = True):
+        '''
+        Saves the mesh to a compact binary file, which can be loaded again with Mesh.load. If "includeFaces" is True,
+        the face table is saved too, so that it doesn't need to be rebuilt.
+        '''
+        tree = self.quadtree
+        info = {'bottomLeft': [self.bottomLeft.x, self.bottomLeft.y], 
+                'horizontalCellCount': self.horizontalCellCount, 'verticalCellCount': self.verticalCellCount,
+                'maxCellSize': self.maxCellSize, 'minCellSize': self.minCellSize}
+        arrays = {'codes': tree.codes, 'levels': tree.levels, 'flags': tree.flags}
+        if includeFaces:
+            for name, array in self.getFaceTable().getArrays().items():
+                arrays['faces.'+name] = array
+        saveArrays(filename, MESH_FILE_TAG, info, arrays)
+    
+    
+    @classmethod
+    def load(cls, filename, mmap = True):
+        '''
+        Loads a mesh saved by Mesh.save. If "mmap" is True, the arrays are memory mapped from the file rather than
+        read in, so even a very large mesh loads almost instantly. The file itself is never changed.
+        '''
+        info, arrays = loadArrays(filename, MESH_FILE_TAG, mmap)
+        mesh = cls(Point(*info['bottomLeft']), info['horizontalCellCount'], info['verticalCellCount'], 
+                   info['maxCellSize'], info['minCellSize'])
+        mesh.quadtree.setLeaves(arrays['codes'], arrays['levels'], arrays['flags'])
+        
+        faceArrays = dict((name[len('faces.'):], array) for name, array in arrays.items() if name.startswith('faces.'))
+        if faceArrays:
+            mesh.faceTable = FaceTable.fromArrays(faceArrays, mesh.version)
+        return mesh
+    
+    
+    def getLeafElement(self, index):
+        '''
+        Returns the Element for the leaf at an index in the quadtree arrays, or None if that leaf is solid.
+        '''
+        if index < 0 or self.quadtree.flags[index] & SOLID:
+            return None
+        return Element(self, int(self.quadtree.levels[index]), int(self.quadtree.codes[index]))
+    
+    
+    def computeCutCells(self, polygons):
+        '''
+        Works out the fluid fraction, wetted face fractions and wall geometry of every leaf cut by the list of 
+        polygons, and returns them as a CutCellGeometry. This should be done once the mesh is refined and the solid
+        cells have been marked. The result is kept until the mesh next changes.
+        '''
+        self.cutCellGeometry = CutCellGeometry(self, polygons)
+        return self.cutCellGeometry
+    
+    
+    def getCutCellGeometry(self):
+        '''
+        Returns the CutCellGeometry from the last call to computeCutCells, or None if it is out of date.
+        '''
+        if self.cutCellGeometry is None or self.cutCellGeometry.version != self.version:
+            return None
+        return self.cutCellGeometry
+    
+    
+    def getLeafArray(self):
+        '''
+        Returns a numpy array of Elements for every leaf in the mesh, including solid leaves, in the same order as 
+        the quadtree arrays. The array is only rebuilt when the mesh version changes.
+        '''
+        if self.leafArrayVersion != self.version:
+            tree = self.quadtree
+            leafArray = numpy.empty(tree.nLeaves(), dtype=object)
+            leafArray[:] = [Element(self, level, code) for level, code in zip(tree.levels.tolist(), tree.codes.tolist())]
+            self.leafArray = leafArray
+            self.leafArrayVersion = self.version
+        return self.leafArray
+    
+    
+    def getLeafElements(self, start=0, stop=None):
+        '''
+        Returns a list of Elements for the non-solid leaves with indices from start up to (but not including) stop.
+        '''
+        if stop is None:
+            stop = self.quadtree.nLeaves()
+        fluid = (self.quadtree.flags[start:stop] & SOLID) == 0
+        return self.getLeafArray()[start:stop][fluid].tolist()
+    
+    
+    def iterLeaves(self):
+        '''
+        A generator which yields the non-solid leaf Elements one at a time, without building a list of all of them.
+        The mesh must not be refined while this is in progress.
+        '''
+        tree = self.quadtree
+        version = self.version
+        for index in range(tree.nLeaves()):
+            if self.version != version:
+                raise Exception("The mesh was refined while iterating over its leaves.")
+            if not tree.flags[index] & SOLID:
+                yield Element(self, int(tree.levels[index]), int(tree.codes[index]))
     
     
     def getElementAtPoint(self, point):
         '''
         Returns a leaf Element which contains the point.
         '''
-        # First, we check that the point does fall inside the mesh.
-        if not self.boundingBox.containsPoint(point):
-            return None
-        
-        # Since the root elements in the mesh have a fixed size and spatial arrangement, it's simple to 
-        # figure out which root element a point is in without having to poll any other elements.
-        
-        # Start by converting the point in (x,y) in global units into a relative coord (i,j) measured in cell counts.
-        relativeLocation = (point - self.bottomLeft).scaledBy(1/self.maxCellSize)
-        i = math.floor(relativeLocation.x)
-        j = math.floor(relativeLocation.y)
-        
-        # Figure out which element that is.
-        e = self.elements[i*self.verticalCellCount+j]
-             
-        # As a safety net, we check that the element does contain the point. If it doesn't, we risk infinite 
-        # recursion. There's probably something wrong if that happens, so let's raise an exception.
-        if e.boundingBox.containsPoint(point):
-            return e.getElementAtPoint(point)
-        else:
-            print("Need to query an element",e,"for a point ",point,", but it's the wrong element.")
-            raise Exception("Fatal Error: Parent mesh attempted to query an element for a point it did not contain.")
+        # The leaves are sorted along a Morton curve, so a single binary search finds the one we're looking for.
+        return self.getLeafElement(self.quadtree.leafIndexAtPoint(point.x, point.y))
+    
+    
+    def locatePoints(self, xs, ys):
+        '''
+        Finds the leaves containing many points at once. "xs" and "ys" are sequences (or numpy arrays) of coordinates,
+        and an array of leaf indices into "Mesh.quadtree" is returned, with -1 for points outside the mesh.
+        Unlike getElementAtPoint, solid leaves are returned too. Use "Mesh.quadtree.flags" to filter them out.
+        '''
+        return self.quadtree.leafIndicesAtPoints(xs, ys)
     
     
     def getPolygons(self):
         '''
         Returns a list of Polygon objects defining each leaf element.
         '''
-        polyList = []
-        for e in self.elements:
-            polyList += e.getPolygons()
-        return polyList
+        return [e.boundingBox.getPolygon() for e in self.getAllElements()]
+    
+    
+    def getEdgeArrays(self):
+        '''
+        Returns arrays (x0, y0, x1, y1) of the end points of every edge of the non-solid leaves, with each edge 
+        listed once. They're worked out from the FaceTable, so no Element or Polygon objects are created.
+        '''
+        faces = self.getFaceTable()
+        fluid = (self.quadtree.flags & SOLID) == 0
+        right = faces.right
+        shown = fluid[faces.left] | ((right >= 0) & fluid[numpy.maximum(right, 0)])
+        
+        # Each face runs along the direction at right angles to its normal.
+        halfX = -faces.normalY[shown]*faces.length[shown]/2
+        halfY = faces.normalX[shown]*faces.length[shown]/2
+        centerX, centerY = faces.centerX[shown], faces.centerY[shown]
+        return centerX - halfX, centerY - halfY, centerX + halfX, centerY + halfY
         
 
     def getElementsAroundPoint(self, point, distance=None):
@@ -303,50 +582,207 @@ class Mesh():
         return removeDuplicates([up, down, left, right, center])
     
     
+    def getGradientIndicator(self, values):
+        '''
+        Returns an error indicator for each leaf, which is the largest jump in "values" (one value per leaf, e.g. 
+        density or pressure) across any of the leaf's faces. Jumps into solid cells are ignored.
+        '''
+        values = numpy.asarray(values, dtype=float)
+        faces = self.getFaceTable()
+        fluid = (self.quadtree.flags & SOLID) == 0
+        interior = (faces.right >= 0)
+        left = faces.left[interior]
+        right = faces.right[interior]
+        inFluid = fluid[left] & fluid[right]
+        left = left[inFluid]
+        right = right[inFluid]
+        
+        jumps = numpy.abs(values[left] - values[right])
+        indicator = numpy.zeros(self.quadtree.nLeaves())
+        numpy.maximum.at(indicator, left, jumps)
+        numpy.maximum.at(indicator, right, jumps)
+        return indicator
+    
+    
+    def adapt(self, indicator, refineAbove, coarsenBelow, state = None):
+        '''
+        Adapts the mesh to the solution. Each leaf has a value in "indicator" (e.g. from getGradientIndicator). 
+        Fluid leaves with values above refineAbove are split, and groups of four sibling leaves which all have values
+        below coarsenBelow are merged back into their parent, as long as this doesn't upset the balance of cell sizes.
+        
+        "state" is an optional array of cell averaged values with one row per leaf, such as the conserved variables. 
+        It is transferred conservatively to the new leaves and returned. 
+        '''
+        tree = self.quadtree
+        indicator = numpy.asarray(indicator, dtype=float)
+        oldCodes = tree.codes
+        oldLevels = tree.levels
+        oldFlags = tree.flags
+        
+        fluid = (oldFlags & SOLID) == 0
+        refine = fluid & (indicator > refineAbove) & (oldLevels < tree.maxLevel)
+        refineCodes = oldCodes[refine]
+        
+        # A leaf marked for refinement is never merged, even if coarsenBelow is above refineAbove.
+        tree.coarsen(numpy.nonzero((indicator < coarsenBelow) & ~refine)[0])
+        
+        # None of the leaves marked for refinement could have been merged, so they can be found again by their codes.
+        tree.split(numpy.searchsorted(tree.codes, refineCodes))
+        tree.balance()
+        
+        # New leaves lie inside a single old leaf, which can't have been a cut cell, so they take on its solidity.
+        fresh = (tree.flags & CLASSIFIED) == 0
+        if fresh.any():
+            splitFrom = numpy.searchsorted(oldCodes, tree.codes[fresh], side='right') - 1
+            tree.flags[fresh] = oldFlags[splitFrom] & (SOLID | CLASSIFIED)
+        
+        if state is not None:
+            return tree.transferValues(oldCodes, oldLevels, state)
+    
+    
+    def getFinestCellsAlongLines(self, lines):
+        '''
+        Returns arrays (i, j) of the finest cells that any of the lines pass through, with no cell listed twice.
+        '''
+        return self.getFinestCellsAlongSegments(*LineList(lines).getEdgeArrays())
+    
+    
+    def getFinestCellsAlongSegments(self, x0, y0, x1, y1):
+        '''
+        Returns arrays (i, j) of the finest cells that any of the segments from (x0, y0) to (x1, y1) pass through, 
+        with no cell listed twice.
+        '''
+        tree = self.quadtree
+        cells = [mortonEncode(*tree.finestCellsAlongSegment(*segment)) 
+                 for segment in zip(*[numpy.asarray(a, dtype=float).tolist() for a in (x0, y0, x1, y1)])]
+        if len(cells) == 0:
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+        i, j = mortonDecode(numpy.unique(numpy.concatenate(cells).astype(numpy.uint64)))
+        return i.astype(numpy.int64), j.astype(numpy.int64)
+    
+    
+    def getFinestCellsAlongPolygons(self, polygons):
+        '''
+        Returns arrays (i, j) of the finest cells that the sides of any of the polygons pass through.
+        '''
+        edges = [polygonEdgeArrays(polygon) for polygon in polygons]
+        return self.getFinestCellsAlongSegments(*[numpy.concatenate([e[k] for e in edges] + [numpy.zeros(0)]) 
+                                                  for k in range(4)])
+    
+    
+    def refineFinestCells(self, i, j):
+        '''
+        Refines the mesh until each of the finest cells (i, j) is a leaf. On each pass, every leaf that still needs
+        refining is split at the same time, so there is one pass per level of refinement. The sizes of neighbouring
+        cells are fixed up once at the end.
+        '''
+        tree = self.quadtree
+        while True:
+            leaves = numpy.unique(tree.leafIndicesAtFinestCoords(i, j))
+            leaves = leaves[(leaves >= 0) & (tree.levels[leaves] < tree.maxLevel)]
+            if len(leaves) == 0:
+                break
+            tree.split(leaves)
+        tree.balance()
+    
+    
     def refineAlongLine(self, line):
-        # We calculate the number of steps needed to ensure that we don't miss any cells.
-        nSteps = math.ceil(line.length()/self.minCellSize)
-        if nSteps < 1:
-            print('Got a line of length',line.length())
-        # nSteps is the number of line segments. Number of points to check is nSteps + 1
-        for i in range(nSteps+1):
-            thisPoint = line.startPoint + (line.endPoint-line.startPoint).scaledBy(i/nSteps)
-            
-            e = self.getElementAtPoint(thisPoint)
-            while e and e.cellSize/2 > e.minCellSize:
-                for element in self.getElementsAroundPoint(thisPoint):
-                    element.split()                    
-                e = self.getElementAtPoint(thisPoint)
+        '''
+        Refines every cell that the line passes through down to the smallest cell size. The cells are found by 
+        walking the line across the grid of the smallest cells, so no cell is missed, however the line is oriented.
+        '''
+        self.refineFinestCells(*self.getFinestCellsAlongLines([line]))
     
     
     def refineAlongPolygon(self, polygon):
-        counter = 0
-        for line in polygon.lines:
-            counter += 1
-            # print("    Resolving along line",counter,":", line)
-            self.refineAlongLine(line)
-            # print("      Detecting solid cells")
-            self.markSolidCells(polygon)
+        self.refineAlongPolygons([polygon])
+    
+    
+    def refineAlongPolygons(self, polygons):
+        '''
+        Refines the mesh along the sides of every polygon in the list "polygons", and marks the cells inside any of 
+        them as solid. All the bodies are refined together, and then classified together using one EdgeIndex over 
+        all of their sides.
+        '''
+        self.refineFinestCells(*self.getFinestCellsAlongPolygons(polygons))
+        # Solid cells are only detected once the refinement is finished, since splitting a cell discards its flags.
+        self.markSolidCellsInPolygons(polygons)
     
     
     def getAllElements(self):
-        elementList = []
-        for e in self.elements:
-            elementList += e.getAllElements()
-        return elementList
+        '''
+        Returns a list of all non-solid leaf elements, in Morton order.
+        '''
+        return self.getLeafElements()
+    
+    
+    def getCutCells(self, polygon):
+        '''
+        Returns a sorted array of the indices of the leaves that the sides of the polygon pass through.
+        '''
+        return self.getCutCellsOfPolygons([polygon])
+    
+    
+    def getCutCellsOfPolygons(self, polygons):
+        '''
+        Returns a sorted array of the indices of the leaves that the sides of any of the polygons pass through.
+        '''
+        leaves = self.quadtree.leafIndicesAtFinestCoords(*self.getFinestCellsAlongPolygons(polygons))
+        return numpy.unique(leaves[leaves >= 0])
     
 
             
     def markSolidCells(self, polygon):
         '''
-        Marks all elements in polygon as solid.
+        Marks all elements in polygon as solid. Elements which are already solid (e.g. inside another polygon) stay 
+        solid, and elements crossed by the sides of the polygon are also marked as boundary elements.
         '''
-        for e in self.getAllElements():
-            if e.isSolid==None and polygon.containsBoundingBox(e.getBoundingBox()):
-                e.isSolid = True
-            else:
-                e.isSolid = False
-            
-
+        self.markSolidCellsInPolygons([polygon])
     
-   
+    
+    def markSolidCellsInPolygons(self, polygons):
+        '''
+        Marks all elements inside any of the polygons as solid, in the same way as markSolidCells. 
+        
+        Only the cells cut by the polygons are tested individually. The rest of the mesh is split into regions that 
+        are connected without crossing a cut cell, and since each of those must lie entirely inside or entirely 
+        outside each polygon, only one cell in each region needs to be tested. The tests use an EdgeIndex, so each
+        point is only checked against the sides near the ray cast from it.
+        '''
+        self.markSolidCellsWithIndex(EdgeIndex(polygons), self.getCutCellsOfPolygons(polygons))
+    
+    
+    def markSolidCellsWithIndex(self, index, cut, within = None):
+        '''
+        Does the work of markSolidCellsInPolygons, given an EdgeIndex over the polygons and the sorted indices of the 
+        leaves that they cut. If the boolean array "within" is given, only the leaves where it is True are classified,
+        and the index only needs the sides that a ray cast in the +x direction from those leaves could cross.
+        '''
+        tree = self.quadtree
+        if within is None:
+            within = numpy.ones(tree.nLeaves(), dtype=bool)
+        isCut = numpy.zeros(tree.nLeaves(), dtype=bool)
+        isCut[cut] = True
+        
+        inside = numpy.zeros(tree.nLeaves(), dtype=bool)
+        
+        i, j, spans = tree.leafCoords()
+        h = tree.finestCellSize
+        
+        regions = self.getFaceTable().labelRegions(~isCut & within)
+        representatives = numpy.unique(regions[~isCut & within])
+        x = tree.x0 + (i[representatives] + spans[representatives]/2)*h
+        y = tree.y0 + (j[representatives] + spans[representatives]/2)*h
+        solidRegions = representatives[index.containsPoints(x, y)]
+        inside[numpy.isin(regions, solidRegions)] = True
+        
+        # A cut cell counts as solid only if all of its corners are inside, as before. 
+        i, j, spans = i[cut], j[cut], spans[cut]
+        cornersInside = numpy.ones(len(cut), dtype=bool)
+        for cornerI, cornerJ in [(i, j), (i + spans, j), (i, j + spans), (i + spans, j + spans)]:
+            cornersInside &= index.containsPoints(tree.x0 + cornerI*h, tree.y0 + cornerJ*h)
+        inside[cut] = cornersInside
+        
+        tree.flags[inside] |= SOLID
+        tree.flags[isCut] |= BOUNDARY
+        tree.flags[within] |= CLASSIFIED
@@ -0,0 +1,219 @@
+'''
+This file is a part of BreezyNS - a simple, general-purpose 2D airflow calculator.
+
+Copyright (c) 2013, Brendan Gray
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+
+
+Created on 17 Oct 2026
+
+@author: AlphanumericSheepPig
+
+A module which provides an on-disk cache of meshes generated from svg files, and of the polygons flattened from them.
+
+A mesh is stored under a key made from a hash of the contents of the svg file and every parameter used to generate
+the mesh, so a change to either the drawing or the mesh settings results in a new mesh being generated. The polygons
+are stored in the same way, keyed by the svg and the flattening parameters only, so a drawing is only parsed and
+flattened again when it changes, even if the mesh settings do.
+
+Whenever a file is added, the least recently used files are deleted until the cache is no bigger than maxCacheSize.
+'''
+
+import os
+import json
+import hashlib
+import numpy
+from pycfdmesh.arrayfile import saveArrays, loadArrays
+from pycfdmesh.geometry import ArrayPolygon
+from pycfdmesh.mesh import Mesh, MESH_FILE_TAG
+from pycfdmesh.svgloader import polygonsFromSVG
+
+
+# Change this whenever meshes generated from the same inputs would come out differently, so that old files are
+# no longer used.
+CACHE_FORMAT = 6
+
+POLYGON_FILE_TAG = b'BRZPOLY1'
+
+# The default limit on the total size of the files in a cache directory, in bytes.
+MAX_CACHE_SIZE = 2**30
+
+_CACHE_EXTENSIONS = ('.mesh', '.poly')
+
+
+
+def _fileHash(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _loadCached(cacheFile, loader):
+    '''
+    Returns loader(cacheFile) if the file exists and can be loaded, or None otherwise. The file's modification time
+    is set to now, since that's what decides which files are least recently used.
+    '''
+    if not os.path.exists(cacheFile):
+        return None
+    try:
+        result = loader(cacheFile)
+    except Exception as e:
+        # A damaged file is no worse than a missing one.
+        print('Could not load cached file '+cacheFile+' ('+str(e)+'). Generating it again.')
+        return None
+    try:
+        os.utime(cacheFile)
+    except OSError:
+        pass
+    return result
+
+
+def _saveCached(cacheFile, saver, maxCacheSize):
+    '''
+    Calls saver(filename) to write a file into the cache, then trims the cache down to maxCacheSize.
+    '''
+    # Write to a temporary file first, so that another run never sees a half written file.
+    os.makedirs(os.path.dirname(cacheFile) or '.', exist_ok=True)
+    tempFile = cacheFile+'.'+str(os.getpid())+'.tmp'
+    saver(tempFile)
+    os.replace(tempFile, cacheFile)
+    if maxCacheSize is not None:
+        evictCache(os.path.dirname(cacheFile) or '.', maxCacheSize, keep=cacheFile)
+
+
+def evictCache(cacheDirectory, maxCacheSize = MAX_CACHE_SIZE, keep = None):
+    '''
+    Deletes the least recently used mesh and polygon files in cacheDirectory until the ones left add up to no more 
+    than maxCacheSize bytes. The file named by "keep" is never deleted, even if it's bigger than the limit on its own.
+    '''
+    entries = []
+    for name in os.listdir(cacheDirectory):
+        if not name.endswith(_CACHE_EXTENSIONS):
+            continue
+        path = os.path.join(cacheDirectory, name)
+        try:
+            status = os.stat(path)
+        except OSError:
+            # Another run may have deleted it already.
+            continue
+        entries.append((status.st_mtime, status.st_size, path))
+    
+    total = sum(size for time, size, path in entries)
+    for time, size, path in sorted(entries):
+        if total <= maxCacheSize:
+            break
+        if keep is not None and os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+
+def meshCacheKey(filename, bottomLeft, horizontalCellCount, verticalCellCount, maxCellSize, minCellSize, 
+                 minLineLength, tolerance):
+    '''
+    Returns a string that uniquely identifies the mesh generated from an svg file with the given parameters.
+    '''
+    svgHash = _fileHash(filename)
+    parameters = json.dumps([MESH_FILE_TAG.decode('ascii'), CACHE_FORMAT, bottomLeft.x, bottomLeft.y, 
+                             horizontalCellCount, verticalCellCount, maxCellSize, minCellSize, minLineLength,
+                             tolerance])
+    return hashlib.sha256((svgHash + parameters).encode('utf-8')).hexdigest()
+
+
+
+def polygonCacheKey(filename, minLineLength, tolerance):
+    '''
+    Returns a string that uniquely identifies the polygons flattened from an svg file with the given parameters.
+    '''
+    parameters = json.dumps([POLYGON_FILE_TAG.decode('ascii'), CACHE_FORMAT, minLineLength, tolerance])
+    return hashlib.sha256((_fileHash(filename) + parameters).encode('utf-8')).hexdigest()
+
+
+
+def savePolygons(filename, polygons):
+    '''
+    Saves a list of polygons to a file, as the ends of all their sides in four arrays and the index of each 
+    polygon's first side.
+    '''
+    edgeArrays = [polygon.getEdgeArrays() for polygon in polygons]
+    counts = [len(edges[0]) for edges in edgeArrays]
+    arrays = {'offsets': numpy.concatenate([[0], numpy.cumsum(counts)]).astype(numpy.int64)}
+    for k, name in enumerate(('startXs', 'startYs', 'endXs', 'endYs')):
+        arrays[name] = numpy.concatenate([numpy.asarray(edges[k], dtype=float) for edges in edgeArrays] + 
+                                         [numpy.zeros(0)])
+    saveArrays(filename, POLYGON_FILE_TAG, {'polygons': len(polygons)}, arrays)
+
+
+
+def loadPolygons(filename):
+    '''
+    Loads a list of polygons saved by savePolygons, as ArrayPolygons.
+    '''
+    info, arrays = loadArrays(filename, POLYGON_FILE_TAG, mmap=False)
+    offsets = arrays['offsets']
+    edgeArrays = [arrays[name] for name in ('startXs', 'startYs', 'endXs', 'endYs')]
+    return [ArrayPolygon(*(array[offsets[i]:offsets[i+1]] for array in edgeArrays)) for i in range(info['polygons'])]
+
+
+
+def cachedPolygonsFromSVG(filename, minLineLength = 0, tolerance = None, cacheDirectory = './meshcache',
+                          maxCacheSize = MAX_CACHE_SIZE, processes = 1):
+    '''
+    Returns the same polygons as svgloader.polygonsFromSVG, but saves them in cacheDirectory, so that the next time 
+    the same file is flattened with the same parameters they're read back from a single file instead. Polygons read
+    from the cache are always ArrayPolygons. "processes" is passed on to polygonsFromSVG.
+    '''
+    cacheFile = os.path.join(cacheDirectory, polygonCacheKey(filename, minLineLength, tolerance)+'.poly')
+    polygons = _loadCached(cacheFile, loadPolygons)
+    if polygons is not None:
+        return polygons
+    
+    polygons = polygonsFromSVG(filename, minLineLength, tolerance, processes)
+    _saveCached(cacheFile, lambda tempFile: savePolygons(tempFile, polygons), maxCacheSize)
+    return polygons
+
+
+
+def meshFromSVG(filename, bottomLeft, horizontalCellCount, verticalCellCount, maxCellSize, minCellSize, 
+                minLineLength = None, cacheDirectory = './meshcache', tolerance = None, 
+                maxCacheSize = MAX_CACHE_SIZE):
+    '''
+    Returns a Mesh (with the same arguments as Mesh) refined around every path in an svg file, with the cells inside
+    the paths marked as solid. The paths are flattened to within "tolerance" of the curves, which defaults to a 
+    tenth of minCellSize, with sides no shorter than minLineLength, which defaults to minCellSize.
+    
+    The mesh is saved in cacheDirectory, and if the same file is meshed again with the same parameters, the saved 
+    mesh is loaded instead of being generated again. The flattened polygons are cached too (see 
+    cachedPolygonsFromSVG), and the cache is kept to no more than maxCacheSize bytes, or unlimited if it's None.
+    '''
+    if minLineLength is None:
+        minLineLength = minCellSize
+    if tolerance is None:
+        tolerance = minCellSize/10
+    
+    key = meshCacheKey(filename, bottomLeft, horizontalCellCount, verticalCellCount, maxCellSize, minCellSize,
+                       minLineLength, tolerance)
+    cacheFile = os.path.join(cacheDirectory, key+'.mesh')
+    
+    mesh = _loadCached(cacheFile, Mesh.load)
+    if mesh is not None:
+        return mesh
+    
+    mesh = Mesh(bottomLeft, horizontalCellCount, verticalCellCount, maxCellSize, minCellSize)
+    mesh.refineAlongPolygons(cachedPolygonsFromSVG(filename, minLineLength, tolerance, cacheDirectory, maxCacheSize))
+    _saveCached(cacheFile, mesh.save, maxCacheSize)
+    
+    return mesh
@@ -0,0 +1,149 @@
+'''
+This file is a part of BreezyNS - a simple, general-purpose 2D airflow calculator.
+
+Copyright (c) 2013, Brendan Gray
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+
+
+Created on 17 Oct 2026
+
+@author: AlphanumericSheepPig
+
+A module which generates a mesh around a set of polygons using several processes.
+
+The root cells of a mesh are independent of each other until the sizes of neighbouring cells are balanced, so the 
+root cells are shared out between worker processes in contiguous runs along the Morton curve. Each worker refines 
+and classifies its own root cells, and once the leaves are gathered back together, the cells along the borders 
+between the runs are balanced in one final pass.
+'''
+
+import multiprocessing
+import numpy
+from pycfdmesh.mesh import Mesh
+from pycfdmesh.geometry import Point
+from pycfdmesh.quadtree import mortonEncode, SOLID, CLASSIFIED
+from pycfdmesh.edgeindex import EdgeIndex, polygonEdgeArrays
+
+
+
+def _buildRootCells(job):
+    '''
+    Runs in a worker process. Refines the root cells that the worker is responsible for down to the given finest 
+    cells, classifies them using only the sides of the polygons that can affect them, and returns the codes, levels 
+    and flags of their leaves.
+    '''
+    (x0, y0, horizontalCellCount, verticalCellCount, maxCellSize, minCellSize, roots, i, j, edges, body, nBodies) = job
+    mesh = Mesh(Point(x0, y0), horizontalCellCount, verticalCellCount, maxCellSize, minCellSize)
+    mesh.refineFinestCells(i, j)
+    
+    tree = mesh.quadtree
+    owned = numpy.isin(tree.rootTiles(tree.codes), roots)
+    leaves = tree.leafIndicesAtFinestCoords(i, j)
+    cut = numpy.unique(leaves[leaves >= 0])
+    mesh.markSolidCellsWithIndex(EdgeIndex.fromEdgeArrays(*edges, body=body, nBodies=nBodies), cut, owned)
+    return tree.codes[owned], tree.levels[owned], tree.flags[owned]
+
+
+
+def generateMesh(bottomLeft, horizontalCellCount, verticalCellCount, maxCellSize, minCellSize, polygons, 
+                 processes = None):
+    '''
+    Returns a Mesh (with the same arguments as Mesh) that has been refined along each of the polygons in the list
+    "polygons", with the cells inside them marked as solid. This gives the same mesh as calling refineAlongPolygons,
+    but the work is shared between "processes" processes, which defaults to the number of CPUs.
+    
+    The sides of the polygons are walked across the grid once, here, and each worker is only sent the finest cells 
+    in its own root cells, and the sides which a ray cast in the +x direction from one of them could cross.
+    '''
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    
+    mesh = Mesh(bottomLeft, horizontalCellCount, verticalCellCount, maxCellSize, minCellSize)
+    tree = mesh.quadtree
+    
+    polygonEdges = [polygonEdgeArrays(polygon) for polygon in polygons]
+    x0, y0, x1, y1 = [numpy.concatenate([e[k] for e in polygonEdges] + [numpy.zeros(0)]).astype(float) 
+                      for k in range(4)]
+    body = numpy.repeat(numpy.arange(len(polygons)), [len(e[0]) for e in polygonEdges])
+    minX, maxX = numpy.minimum(x0, x1), numpy.maximum(x0, x1)
+    minY, maxY = numpy.minimum(y0, y1), numpy.maximum(y0, y1)
+    
+    i, j = mesh.getFinestCellsAlongSegments(x0, y0, x1, y1)
+    cellRoots = tree.rootTiles(mortonEncode(i.astype(numpy.uint64), j.astype(numpy.uint64)))
+    
+    # Share the root cells out in Morton order, so that each worker gets a compact block of the mesh. Most of the 
+    # work is along the polygons, so each root cell is weighted by the number of the smallest cells it must contain.
+    roots = tree.rootTiles(tree.codes)
+    weights = 1 + numpy.bincount(cellRoots, minlength=len(roots))[roots]
+    cumulativeWeight = numpy.cumsum(weights)
+    chunks = numpy.minimum((cumulativeWeight - 1)*processes//cumulativeWeight[-1], processes - 1)
+    
+    jobs = []
+    for chunk in range(processes):
+        chunkRoots = roots[chunks == chunk]
+        if len(chunkRoots) == 0:
+            continue
+        inChunk = numpy.isin(cellRoots, chunkRoots)
+        
+        # Root cells are numbered i*verticalCellCount + j, so this is the box around the chunk's root cells.
+        left = tree.x0 + (chunkRoots//verticalCellCount).min()*maxCellSize
+        bottom = tree.y0 + (chunkRoots % verticalCellCount).min()*maxCellSize
+        top = tree.y0 + ((chunkRoots % verticalCellCount).max() + 1)*maxCellSize
+        nearby = (maxX >= left) & (maxY >= bottom) & (minY <= top)
+        
+        jobs.append((bottomLeft.x, bottomLeft.y, horizontalCellCount, verticalCellCount, maxCellSize, minCellSize,
+                     chunkRoots, i[inChunk], j[inChunk], (x0[nearby], y0[nearby], x1[nearby], y1[nearby]), 
+                     body[nearby], len(polygons)))
+    
+    if processes > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(processes, len(jobs)))
+        try:
+            results = pool.map(_buildRootCells, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_buildRootCells(job) for job in jobs]
+    
+    codes = numpy.concatenate([r[0] for r in results])
+    levels = numpy.concatenate([r[1] for r in results])
+    flags = numpy.concatenate([r[2] for r in results])
+    order = numpy.argsort(codes)
+    tree.setLeaves(codes[order], levels[order], flags[order])
+    
+    stitchRootCells(mesh)
+    return mesh
+
+
+
+def stitchRootCells(mesh):
+    '''
+    Balances the sizes of the cells along the sides of every root cell, for meshes whose root cells were refined 
+    separately. Cells split to do so take on the solidity of the cell they were split from.
+    '''
+    tree = mesh.quadtree
+    codes = tree.codes
+    flags = tree.flags
+    
+    i, j, spans = tree.leafCoords()
+    rootSpan = tree.span(0)
+    onBorder = (i % rootSpan == 0) | (j % rootSpan == 0) | ((i + spans) % rootSpan == 0) | ((j + spans) % rootSpan == 0)
+    tree.markUnbalanced(onBorder)
+    tree.balance()
+    
+    # Cells cut by a polygon are already as small as possible, so any cell split here lies entirely inside or 
+    # entirely outside every polygon.
+    fresh = (tree.flags & CLASSIFIED) == 0
+    if tree.nLeaves() > len(codes) and fresh.any():
+        splitFrom = numpy.searchsorted(codes, tree.codes[fresh], side='right') - 1
+        tree.flags[fresh] = flags[splitFrom] & (SOLID | CLASSIFIED)
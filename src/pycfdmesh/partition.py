@@ -0,0 +1,249 @@
+'''
+This file is a part of BreezyNS - a simple, general-purpose 2D airflow calculator.
+
+Copyright (c) 2013, Brendan Gray
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+
+
+Created on 17 Oct 2026
+
+@author: AlphanumericSheepPig
+
+A module for splitting a mesh into subdomains, so that a solver can work on each of them in a separate process.
+
+The leaves are cut into runs along the mesh's space filling curve (see Mesh.reorder), each with about the same total
+weight, so every subdomain is a compact patch of the mesh. Each subdomain keeps a layer of ghost cells, which are
+the cells owned by other subdomains that share a face with one of its own cells. Between steps, the values in the
+ghost cells are brought up to date by a HaloExchange, which sends each neighbouring subdomain the values it needs.
+
+Only the HaloExchange knows how the processes talk to each other (multiprocessing pipes here), so a solver written
+against Subdomain and HaloExchange could later be run with MPI instead.
+'''
+
+import multiprocessing
+import numpy
+from pycfdmesh.quadtree import SOLID
+
+
+
+class Subdomain():
+    '''
+    The part of a mesh handled by one process. Cells are numbered locally, with the cells the subdomain owns first,
+    followed by its ghost cells:
+        Subdomain.cells contains the leaf indices of the owned cells, in the order they lie along the curve.
+        Subdomain.ghosts contains the leaf indices of the ghost cells, grouped by the subdomain that owns them.
+        Subdomain.ghostOwners contains the rank of the subdomain owning each ghost cell.
+        Subdomain.faces contains the indices in the mesh's FaceTable of every face touching an owned cell.
+        Subdomain.faceLeft and Subdomain.faceRight contain the local numbers of the cells on either side of each of
+            those faces, with -1 on the edge of the mesh as in the FaceTable.
+        Subdomain.sendCells and Subdomain.receiveCells are dicts, keyed by the rank of each neighbouring subdomain,
+            of the local numbers of the cells to send to it and the ghost cells to fill from it. The two lists for
+            each pair of subdomains are in the same order, so the values can be sent as a plain array.
+    '''
+
+    def __init__(self, rank, cells):
+        self.rank = rank
+        self.cells = cells
+        self.ghosts = numpy.zeros(0, dtype=numpy.int64)
+        self.ghostOwners = numpy.zeros(0, dtype=numpy.int64)
+        self.faces = numpy.zeros(0, dtype=numpy.int64)
+        self.faceLeft = numpy.zeros(0, dtype=numpy.int64)
+        self.faceRight = numpy.zeros(0, dtype=numpy.int64)
+        self.sendCells = {}
+        self.receiveCells = {}
+
+
+    def nOwned(self):
+        return len(self.cells)
+
+
+    def nLocal(self):
+        return len(self.cells) + len(self.ghosts)
+
+
+    def getLocalCells(self):
+        '''
+        Returns the leaf indices of every local cell, owned cells first and then ghost cells.
+        '''
+        return numpy.concatenate([self.cells, self.ghosts])
+
+
+    def gather(self, values):
+        '''
+        Takes the rows of an array with one row per leaf that belong to the local cells, including the ghosts.
+        '''
+        return numpy.asarray(values)[self.getLocalCells()]
+
+
+    def scatter(self, localValues, values):
+        '''
+        Writes the rows for the owned cells from an array of local values back into an array with one row per leaf.
+        '''
+        values[self.cells] = localValues[:self.nOwned()]
+
+
+    def neighbours(self):
+        '''
+        Returns a sorted list of the ranks of the subdomains that this one exchanges ghost cells with.
+        '''
+        return sorted(self.receiveCells)
+
+
+    def __repr__(self):
+        return ("Subdomain "+str(self.rank)+" with "+str(self.nOwned())+" cells, "+str(len(self.ghosts))+
+                " ghost cells and "+str(len(self.receiveCells))+" neighbours.")
+
+
+
+def partitionMesh(mesh, nParts, weights = None):
+    '''
+    Splits the leaves of a mesh into nParts subdomains, and returns a list of Subdomains. Each subdomain is a run of
+    cells along the curve set by Mesh.reorder, with about the same total weight. "weights" gives the cost of each
+    leaf, and defaults to 1 for fluid cells and 0 for solid cells, since the solver skips those.
+    '''
+    tree = mesh.quadtree
+    nCells = tree.nLeaves()
+    order = mesh.getCellOrder()
+    faceTable = mesh.getFaceTable()
+
+    if weights is None:
+        weights = numpy.where(tree.flags & SOLID, 0.0, 1.0)
+    weights = numpy.asarray(weights, dtype=float)[order]
+    cumulativeWeight = numpy.cumsum(weights)
+    total = cumulativeWeight[-1] if nCells > 0 and cumulativeWeight[-1] > 0 else 1.0
+    # Each cell goes to the part containing the start of its share of the total weight.
+    partAlongCurve = numpy.minimum(((cumulativeWeight - weights)*nParts/total).astype(numpy.int64), nParts - 1)
+    owner = numpy.empty(nCells, dtype=numpy.int64)
+    owner[order] = partAlongCurve
+
+    rank = numpy.empty(nCells, dtype=numpy.int64)
+    rank[order] = numpy.arange(nCells)
+    starts = numpy.searchsorted(partAlongCurve, numpy.arange(nParts + 1))
+    subdomains = [Subdomain(p, order[starts[p]:starts[p+1]]) for p in range(nParts)]
+
+    interior = faceTable.right >= 0
+    leftOwner = owner[faceTable.left]
+    rightOwner = numpy.where(interior, owner[numpy.maximum(faceTable.right, 0)], -1)
+
+    # A ghost cell is one across a face between two subdomains.
+    crossing = interior & (leftOwner != rightOwner)
+    pairOwner = numpy.concatenate([leftOwner[crossing], rightOwner[crossing]])
+    pairGhost = numpy.concatenate([faceTable.right[crossing], faceTable.left[crossing]])
+    pairGhostOwner = numpy.concatenate([rightOwner[crossing], leftOwner[crossing]])
+
+    localIndex = numpy.full(nCells, -1, dtype=numpy.int64)
+    for subdomain in subdomains:
+        p = subdomain.rank
+        isGhost = pairOwner == p
+        ghosts = numpy.unique(pairGhost[isGhost])
+        ghostOwners = owner[ghosts]
+        # Group the ghosts by owner, in curve order within each group, to match the owner's send list.
+        ghostOrder = numpy.lexsort((rank[ghosts], ghostOwners))
+        subdomain.ghosts = ghosts[ghostOrder]
+        subdomain.ghostOwners = ghostOwners[ghostOrder]
+
+        localIndex[subdomain.cells] = numpy.arange(subdomain.nOwned())
+        localIndex[subdomain.ghosts] = subdomain.nOwned() + numpy.arange(len(subdomain.ghosts))
+
+        subdomain.faces = numpy.nonzero((leftOwner == p) | (rightOwner == p))[0]
+        subdomain.faceLeft = localIndex[faceTable.left[subdomain.faces]]
+        right = faceTable.right[subdomain.faces]
+        subdomain.faceRight = numpy.where(right >= 0, localIndex[numpy.maximum(right, 0)], -1)
+
+        for q in numpy.unique(subdomain.ghostOwners):
+            fromQ = subdomain.ghostOwners == q
+            subdomain.receiveCells[int(q)] = subdomain.nOwned() + numpy.nonzero(fromQ)[0]
+            # The owner's local numbers for its own cells are just their positions along its run of the curve.
+            subdomains[q].sendCells[p] = rank[subdomain.ghosts[fromQ]] - starts[q]
+
+        localIndex[subdomain.cells] = -1
+        localIndex[subdomain.ghosts] = -1
+
+    return subdomains
+
+
+
+class HaloExchange():
+    '''
+    Fills the ghost cells of one subdomain with the latest values from the subdomains that own them. "connections"
+    is a dict of multiprocessing Connections, keyed by the rank of the neighbouring subdomain at the other end.
+    '''
+
+    def __init__(self, subdomain, connections):
+        self.subdomain = subdomain
+        self.rank = subdomain.rank
+        self.connections = connections
+
+
+    def exchange(self, values):
+        '''
+        Sends the owned values that neighbouring subdomains need, and fills in the ghost rows of "values" (an array
+        with one row per local cell) with the values received, in place. Every subdomain must call this at the same
+        point.
+        '''
+        # Each pair of subdomains is dealt with in the same order by both, and the lower rank sends first, so no
+        # two processes are ever both waiting to send to each other.
+        for q in self.subdomain.neighbours():
+            connection = self.connections[q]
+            if self.rank < q:
+                connection.send(values[self.subdomain.sendCells[q]])
+                values[self.subdomain.receiveCells[q]] = connection.recv()
+            else:
+                values[self.subdomain.receiveCells[q]] = connection.recv()
+                connection.send(values[self.subdomain.sendCells[q]])
+        return values
+
+
+
+def _runSubdomain(worker, subdomain, connections, args, resultConnection):
+    '''
+    Runs in a worker process. Calls the worker function for one subdomain and sends back what it returns.
+    '''
+    result = worker(subdomain, HaloExchange(subdomain, connections), *args)
+    resultConnection.send(result)
+    resultConnection.close()
+
+
+
+def runPartitioned(mesh, nParts, worker, args = (), weights = None):
+    '''
+    Splits the mesh into nParts subdomains, and calls worker(subdomain, haloExchange, *args) for each of them in its
+    own process. Returns a list of whatever the worker calls return, in order of rank. The worker must be a function
+    defined at the top level of a module, so that it can be sent to the other processes.
+    '''
+    subdomains = partitionMesh(mesh, nParts, weights)
+    if nParts == 1:
+        return [worker(subdomains[0], HaloExchange(subdomains[0], {}), *args)]
+
+    connections = [{} for subdomain in subdomains]
+    for subdomain in subdomains:
+        for q in subdomain.neighbours():
+            if subdomain.rank < q:
+                connections[subdomain.rank][q], connections[q][subdomain.rank] = multiprocessing.Pipe()
+
+    processes = []
+    resultConnections = []
+    for subdomain in subdomains:
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_runSubdomain,
+                                          args=(worker, subdomain, connections[subdomain.rank], args, sender))
+        process.start()
+        processes.append(process)
+        resultConnections.append(receiver)
+
+    try:
+        results = [receiver.recv() for receiver in resultConnections]
+    finally:
+        for process in processes:
+            process.join()
+    return results
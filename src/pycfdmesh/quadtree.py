@@ -0,0 +1,549 @@
+'''
+This file is a part of BreezyNS - a simple, general-purpose 2D airflow calculator.
+
+Copyright (c) 2013, Brendan Gray
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+
+
+Created on 17 Oct 2026
+
+@author: AlphanumericSheepPig
+
+A module which provides a linear quadtree, used as the storage backend for the Mesh.
+
+Rather than storing each cell as an object, the leaves of the quadtree are stored in a handful of contiguous arrays
+sorted by Morton code (also called Z-order). Every cell is addressed by its level (0 for the root cells of size
+maxCellSize, increasing by one with each split) and the Morton code of its bottom left corner, measured in integer
+units of the finest cell that the mesh may contain. The leaves of a complete quadtree form a partition of the Morton
+curve, so the leaf containing any point is found with a single binary search, and all the leaves inside a cell form
+one contiguous slice of the arrays.
+'''
+
+import numpy
+
+
+# Bit flags stored per leaf in LinearQuadtree.flags
+SOLID = 1        # The leaf lies inside a solid body.
+CLASSIFIED = 2   # The leaf has been checked for solidity. If this is not set, Element.isSolid is None.
+BOUNDARY = 4     # The leaf is crossed by the boundary of a solid body.
+
+
+def _spreadBits(n):
+    '''
+    Spreads the lower 32 bits of n so that there is a zero bit between each of them. Works on both Python ints and
+    numpy uint64 arrays.
+    '''
+    n = n & 0x00000000FFFFFFFF
+    n = (n | (n << 16)) & 0x0000FFFF0000FFFF
+    n = (n | (n << 8))  & 0x00FF00FF00FF00FF
+    n = (n | (n << 4))  & 0x0F0F0F0F0F0F0F0F
+    n = (n | (n << 2))  & 0x3333333333333333
+    n = (n | (n << 1))  & 0x5555555555555555
+    return n
+
+
+def _compactBits(n):
+    '''
+    The inverse of _spreadBits. Collects every second bit of n, starting from the lowest bit.
+    '''
+    n = n & 0x5555555555555555
+    n = (n | (n >> 1))  & 0x3333333333333333
+    n = (n | (n >> 2))  & 0x0F0F0F0F0F0F0F0F
+    n = (n | (n >> 4))  & 0x00FF00FF00FF00FF
+    n = (n | (n >> 8))  & 0x0000FFFF0000FFFF
+    n = (n | (n >> 16)) & 0x00000000FFFFFFFF
+    return n
+
+
+def mortonEncode(i, j):
+    '''
+    Returns the Morton code for the integer coordinates (i, j). The bits of i occupy the even positions, so
+    that the four children of a cell are ordered bottom left, bottom right, top left, top right.
+    '''
+    return _spreadBits(i) | (_spreadBits(j) << 1)
+
+
+def mortonDecode(code):
+    '''
+    Returns the integer coordinates (i, j) encoded in a Morton code.
+    '''
+    return _compactBits(code), _compactBits(code >> 1)
+
+
+def hilbertEncode(i, j, bits):
+    '''
+    Returns the position along a Hilbert curve of the integer coordinates (i, j), for a curve filling a square with
+    2^bits cells along each side. Unlike the Morton curve, consecutive cells along the Hilbert curve always share a
+    side.
+    '''
+    i = numpy.array(i, dtype=numpy.uint64)
+    j = numpy.array(j, dtype=numpy.uint64)
+    d = numpy.zeros(i.shape, dtype=numpy.uint64)
+    for bit in range(bits - 1, -1, -1):
+        s = numpy.uint64(1 << bit)
+        ri = (i & s) > 0
+        rj = (j & s) > 0
+        d += s*s*((3*ri.astype(numpy.uint64)) ^ rj.astype(numpy.uint64))
+        # Rotate the quadrant so that the curve inside it starts and ends in the right corners.
+        i &= s - numpy.uint64(1)
+        j &= s - numpy.uint64(1)
+        flip = ~rj & ri
+        i[flip] = s - numpy.uint64(1) - i[flip]
+        j[flip] = s - numpy.uint64(1) - j[flip]
+        swap = ~rj
+        i[swap], j[swap] = j[swap], i[swap].copy()
+    return d
+
+
+
+class LinearQuadtree():
+    '''
+    Stores the leaves of a forest of quadtrees, one per root cell, in arrays sorted by Morton code.
+        LinearQuadtree.codes contains the Morton code of the bottom left corner of each leaf, in finest cell units.
+        LinearQuadtree.levels contains the level of each leaf.
+        LinearQuadtree.flags contains the SOLID, CLASSIFIED and BOUNDARY bits of each leaf.
+    A leaf is referred to by its index into these arrays. Indices change whenever the tree is split, so anything
+    that needs to hold on to a cell should rather use its (level, code) pair.
+    '''
+
+    def __init__(self, bottomLeft, horizontalCellCount, verticalCellCount, maxCellSize, minCellSize):
+        self.x0 = bottomLeft.x
+        self.y0 = bottomLeft.y
+        self.horizontalCellCount = horizontalCellCount
+        self.verticalCellCount = verticalCellCount
+        self.maxCellSize = maxCellSize
+        self.minCellSize = minCellSize
+
+        # A cell may only be split if its children would still be larger than minCellSize.
+        maxLevel = 0
+        cellSize = maxCellSize
+        while cellSize/2 > minCellSize:
+            cellSize = cellSize/2
+            maxLevel += 1
+        self.maxLevel = maxLevel
+        self.finestCellSize = cellSize
+
+        self.finestHorizontalCount = horizontalCellCount << maxLevel
+        self.finestVerticalCount = verticalCellCount << maxLevel
+        if max(self.finestHorizontalCount, self.finestVerticalCount) > 0xFFFFFFFF:
+            raise Exception("Mesh is too large. Cannot index more than 2^32 of the smallest cells in each direction.")
+
+        i, j = numpy.meshgrid(numpy.arange(horizontalCellCount, dtype=numpy.uint64),
+                              numpy.arange(verticalCellCount, dtype=numpy.uint64), indexing='ij')
+        rootCodes = mortonEncode(i.ravel() << maxLevel, j.ravel() << maxLevel)
+
+        self.codes = numpy.sort(rootCodes)
+        self.levels = numpy.zeros(len(self.codes), dtype=numpy.uint8)
+        self.flags = numpy.zeros(len(self.codes), dtype=numpy.uint8)
+
+        # Incremented every time the leaves change, so that anything derived from them knows when to rebuild.
+        self.version = 0
+
+        # The (level, code) pairs of leaves created by split() that haven't been checked by balance() yet.
+        self.unbalancedLevels = []
+        self.unbalancedCodes = []
+
+
+    def nLeaves(self):
+        return len(self.codes)
+
+
+    def cellSize(self, level):
+        return self.maxCellSize/(1 << int(level))
+
+
+    def span(self, level):
+        '''
+        Returns the number of finest cells along each side of a cell at the given level.
+        '''
+        return 1 << (self.maxLevel - int(level))
+
+
+    def cellCoords(self, level, code):
+        '''
+        Returns the integer coordinates (i, j) of a cell, counted in cells of its own size from the bottom left.
+        '''
+        shift = self.maxLevel - int(level)
+        i, j = mortonDecode(int(code))
+        return i >> shift, j >> shift
+
+
+    def cellCenter(self, level, code):
+        '''
+        Returns the (x, y) coordinates of the center of a cell.
+        '''
+        i, j = mortonDecode(int(code))
+        halfSpan = self.span(level)/2
+        return (self.x0 + (i + halfSpan)*self.finestCellSize,
+                self.y0 + (j + halfSpan)*self.finestCellSize)
+
+
+    def parentCode(self, level, code):
+        '''
+        Returns the Morton code of the parent of a cell. The parent is one level up.
+        '''
+        return int(code) & ~(self.span(level - 1)*self.span(level - 1) - 1)
+
+
+    def childCodes(self, level, code):
+        '''
+        Returns the Morton codes of the four children of a cell in Morton order (bottom left, bottom right, top left
+        and top right). The children are one level down.
+        '''
+        childArea = self.span(level + 1)*self.span(level + 1)
+        return [int(code) + k*childArea for k in range(4)]
+
+
+    def finestCoordsAtPoint(self, x, y):
+        '''
+        Returns the integer coordinates of the finest cell containing the point (x, y), or None if the point
+        is outside the mesh. Points on the upper and right edges of the mesh belong to the last cell.
+        '''
+        i = int((x - self.x0)//self.finestCellSize)
+        j = int((y - self.y0)//self.finestCellSize)
+        if i == self.finestHorizontalCount and x - self.x0 <= self.horizontalCellCount*self.maxCellSize:
+            i -= 1
+        if j == self.finestVerticalCount and y - self.y0 <= self.verticalCellCount*self.maxCellSize:
+            j -= 1
+        if i < 0 or j < 0 or i >= self.finestHorizontalCount or j >= self.finestVerticalCount:
+            return None
+        return i, j
+
+
+    def leafIndexAtFinestCoords(self, i, j):
+        '''
+        Returns the index of the leaf that covers the finest cell (i, j). The coordinates must be inside the mesh.
+        '''
+        return int(numpy.searchsorted(self.codes, mortonEncode(i, j), side='right')) - 1
+
+
+    def leafIndicesAtFinestCoords(self, i, j):
+        '''
+        Array version of leafIndexAtFinestCoords. Entries where (i, j) falls outside the mesh are set to -1.
+        '''
+        i = numpy.asarray(i, dtype=numpy.int64)
+        j = numpy.asarray(j, dtype=numpy.int64)
+        inside = (i >= 0) & (j >= 0) & (i < self.finestHorizontalCount) & (j < self.finestVerticalCount)
+        codes = mortonEncode(numpy.where(inside, i, 0).astype(numpy.uint64), numpy.where(inside, j, 0).astype(numpy.uint64))
+        indices = numpy.searchsorted(self.codes, codes, side='right') - 1
+        return numpy.where(inside, indices, -1)
+
+
+    def leafCoords(self):
+        '''
+        Returns arrays of the finest cell coordinates (i, j) of the bottom left corner of every leaf, and the number
+        of finest cells along each side of every leaf.
+        '''
+        i, j = mortonDecode(self.codes)
+        spans = numpy.left_shift(1, self.maxLevel - self.levels.astype(numpy.int64))
+        return i.astype(numpy.int64), j.astype(numpy.int64), spans
+
+
+    def leafIndexAtPoint(self, x, y):
+        '''
+        Returns the index of the leaf that contains the point (x, y), or -1 if the point is outside the mesh.
+        '''
+        coords = self.finestCoordsAtPoint(x, y)
+        if coords is None:
+            return -1
+        return self.leafIndexAtFinestCoords(*coords)
+
+
+    def leafIndicesAtPoints(self, xs, ys):
+        '''
+        Array version of leafIndexAtPoint. Takes arrays of x and y coordinates and returns an array of leaf indices,
+        with -1 for points outside the mesh.
+        '''
+        xs = numpy.asarray(xs, dtype=float) - self.x0
+        ys = numpy.asarray(ys, dtype=float) - self.y0
+        width = self.horizontalCellCount*self.maxCellSize
+        height = self.verticalCellCount*self.maxCellSize
+        inside = (xs >= 0) & (ys >= 0) & (xs <= width) & (ys <= height)
+
+        # Points on the upper and right edges of the mesh are pulled back into the last cell, as for a single point.
+        i = numpy.minimum(numpy.floor(numpy.where(inside, xs, 0)/self.finestCellSize), self.finestHorizontalCount-1)
+        j = numpy.minimum(numpy.floor(numpy.where(inside, ys, 0)/self.finestCellSize), self.finestVerticalCount-1)
+        indices = self.leafIndicesAtFinestCoords(i.astype(numpy.int64), j.astype(numpy.int64))
+        return numpy.where(inside, indices, -1)
+
+
+    def finestCellsAlongSegment(self, x0, y0, x1, y1):
+        '''
+        Returns arrays (i, j) of the finest cells touched by the line segment from (x0, y0) to (x1, y1), clipped to
+        the mesh. This is a supercover: every cell that the segment passes through is included, even if it only
+        clips a corner. Cells are listed column by column, and no cell is listed twice.
+        '''
+        # Work in finest cell units, from left to right.
+        u0 = (x0 - self.x0)/self.finestCellSize
+        v0 = (y0 - self.y0)/self.finestCellSize
+        u1 = (x1 - self.x0)/self.finestCellSize
+        v1 = (y1 - self.y0)/self.finestCellSize
+        if u1 < u0:
+            u0, v0, u1, v1 = u1, v1, u0, v0
+
+        columns = numpy.arange(max(int(numpy.floor(u0)), 0), min(int(numpy.floor(u1)), self.finestHorizontalCount-1)+1)
+        if len(columns) == 0:
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+
+        # Find the span of y covered by the segment within each column.
+        if u1 == u0:
+            ya = numpy.full(len(columns), v0)
+            yb = numpy.full(len(columns), v1)
+        else:
+            slope = (v1 - v0)/(u1 - u0)
+            ya = v0 + (numpy.maximum(columns, u0) - u0)*slope
+            yb = v0 + (numpy.minimum(columns+1, u1) - u0)*slope
+        rowStart = numpy.maximum(numpy.floor(numpy.minimum(ya, yb)), 0).astype(numpy.int64)
+        rowStop = numpy.minimum(numpy.floor(numpy.maximum(ya, yb)), self.finestVerticalCount-1).astype(numpy.int64) + 1
+        counts = numpy.maximum(rowStop - rowStart, 0)
+
+        i = numpy.repeat(columns, counts)
+        firstInColumn = numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        j = numpy.repeat(rowStart, counts) + numpy.arange(len(i)) - firstInColumn
+        return i, j
+
+
+    def leafIndicesAlongSegment(self, x0, y0, x1, y1):
+        '''
+        Returns a sorted array of the indices of the leaves touched by the line segment from (x0, y0) to (x1, y1).
+        '''
+        i, j = self.finestCellsAlongSegment(x0, y0, x1, y1)
+        return numpy.unique(self.leafIndicesAtFinestCoords(i, j))
+
+
+    def leafIndex(self, level, code):
+        '''
+        Returns the index of the leaf with the given level and code, or -1 if that cell is not a leaf.
+        '''
+        index = int(numpy.searchsorted(self.codes, code))
+        if index < len(self.codes) and self.codes[index] == code and self.levels[index] == level:
+            return index
+        return -1
+
+
+    def leafRange(self, level, code):
+        '''
+        Returns the (start, stop) slice of leaf indices which lie inside the given cell. If the cell is itself a leaf,
+        this is a single index. If the cell is inside a leaf, then that leaf is returned.
+        '''
+        area = self.span(level)*self.span(level)
+        start = int(numpy.searchsorted(self.codes, code, side='right')) - 1
+        stop = int(numpy.searchsorted(self.codes, int(code) + area))
+        return start, stop
+
+
+    def split(self, indices):
+        '''
+        Replaces each of the leaves at the given indices with its four children, all in one pass over the arrays.
+        Leaves that are already at the finest level are left alone. The children start off with no flags set.
+        Returns the indices of the new children in the updated arrays.
+        Splitting does not check the sizes of the neighbouring cells. The new children are recorded, and balance()
+        should be called once all the splitting is done.
+        '''
+        indices = numpy.unique(numpy.asarray(indices, dtype=numpy.int64))
+        indices = indices[self.levels[indices] < self.maxLevel]
+        if len(indices) == 0:
+            return numpy.zeros(0, dtype=numpy.int64)
+
+        counts = numpy.ones(len(self.codes), dtype=numpy.int64)
+        counts[indices] = 4
+        newCodes = numpy.repeat(self.codes, counts)
+        newLevels = numpy.repeat(self.levels, counts)
+        newFlags = numpy.repeat(self.flags, counts)
+
+        # The first child of each split leaf lands where the leaf would have been, shifted along by three places
+        # for every leaf split before it.
+        firstChild = indices + 3*numpy.arange(len(indices))
+        childLevels = self.levels[indices] + 1
+        childArea = numpy.left_shift(numpy.uint64(1), 2*(self.maxLevel - childLevels).astype(numpy.uint64))
+        for k in range(4):
+            newCodes[firstChild + k] += numpy.uint64(k)*childArea
+            newLevels[firstChild + k] = childLevels
+            newFlags[firstChild + k] = 0
+
+        self.codes = newCodes
+        self.levels = newLevels
+        self.flags = newFlags
+        self.version += 1
+
+        children = (firstChild[:, None] + numpy.arange(4)).ravel()
+        self.unbalancedLevels.append(newLevels[children])
+        self.unbalancedCodes.append(newCodes[children])
+        return children
+
+
+    def coarsen(self, indices):
+        '''
+        Merges groups of four sibling leaves back into their parent, where all four of them are at the given indices.
+        A group is only merged if the four leaves have the same flags and aren't boundary cells, and if the parent 
+        would not end up next to a leaf more than twice its size smaller. The parent takes the flags of its children.
+        Returns the number of groups merged.
+        '''
+        n = self.nLeaves()
+        marked = numpy.zeros(n, dtype=bool)
+        marked[numpy.asarray(indices, dtype=numpy.int64)] = True
+        
+        # The first of the four siblings must be aligned with the parent, and the other three follow it directly.
+        first = numpy.nonzero(marked[:max(n-3, 0)] & (self.levels[:max(n-3, 0)] > 0))[0]
+        levels = self.levels[first]
+        childArea = numpy.left_shift(numpy.uint64(1), 2*(self.maxLevel - levels).astype(numpy.uint64))
+        first = first[self.codes[first] % (4*childArea) == 0]
+        levels = self.levels[first]
+        childArea = numpy.left_shift(numpy.uint64(1), 2*(self.maxLevel - levels).astype(numpy.uint64))
+        
+        mergeable = (self.flags[first] & BOUNDARY) == 0
+        for k in range(1, 4):
+            mergeable &= marked[first + k] & (self.levels[first + k] == levels)
+            mergeable &= self.codes[first + k] == self.codes[first] + numpy.uint64(k)*childArea
+            mergeable &= self.flags[first + k] == self.flags[first]
+        first = first[mergeable]
+        levels = levels[mergeable]
+        
+        # Every leaf next to the merged parent must be at most one level finer than it, i.e. no finer than the
+        # children being merged.
+        siblings = (first[:, None] + numpy.arange(4)).ravel()
+        neighbours = self.neighbourIndices(siblings).reshape(len(first), 16)
+        neighbourLevels = numpy.where(neighbours >= 0, self.levels[numpy.maximum(neighbours, 0)], 0)
+        first = first[(neighbourLevels <= levels[:, None]).all(axis=1)]
+        if len(first) == 0:
+            return 0
+        
+        keep = numpy.ones(n, dtype=bool)
+        for k in range(1, 4):
+            keep[first + k] = False
+        levels = self.levels.copy()
+        levels[first] -= 1
+        self.codes = self.codes[keep]
+        self.levels = levels[keep]
+        self.flags = self.flags[keep]
+        self.version += 1
+        return len(first)
+
+
+    def transferValues(self, oldCodes, oldLevels, values):
+        '''
+        Takes an array of values per leaf for the leaves described by oldCodes and oldLevels (e.g. from before the 
+        quadtree was split or coarsened), and returns the equivalent array for the current leaves. Values are 
+        treated as averages over each cell, and are transferred conservatively: a leaf inside an old leaf takes its 
+        value, and a leaf made up of several old leaves takes their area weighted average. "values" may have more 
+        than one dimension, as long as the first is the leaf index.
+        '''
+        values = numpy.asarray(values)
+        oldLevels = numpy.asarray(oldLevels)
+        start = numpy.searchsorted(oldCodes, self.codes, side='right') - 1
+        result = values[start].astype(float)
+        
+        merged = numpy.nonzero(oldLevels[start] > self.levels)[0]
+        if len(merged) > 0:
+            areas = numpy.left_shift(numpy.uint64(1), 2*(self.maxLevel - self.levels[merged]).astype(numpy.uint64))
+            stop = numpy.searchsorted(oldCodes, self.codes[merged] + areas)
+            
+            oldAreas = numpy.left_shift(1, 2*(self.maxLevel - oldLevels.astype(numpy.int64))).astype(float)
+            weighted = values*oldAreas.reshape((-1,) + (1,)*(values.ndim - 1))
+            weighted = numpy.concatenate([weighted, numpy.zeros((1,) + values.shape[1:])])
+            bounds = numpy.stack([start[merged], stop], axis=1).ravel()
+            totals = numpy.add.reduceat(weighted, bounds, axis=0)[::2]
+            result[merged] = totals/areas.astype(float).reshape((-1,) + (1,)*(values.ndim - 1))
+        
+        return result
+
+
+    def setLeaves(self, codes, levels, flags):
+        '''
+        Replaces all of the leaves at once, e.g. with leaves that were built elsewhere. The codes must be sorted and
+        must describe a complete quadtree over the same root cells. The new leaves are not checked by balance().
+        '''
+        self.codes = numpy.asarray(codes, dtype=numpy.uint64)
+        self.levels = numpy.asarray(levels, dtype=numpy.uint8)
+        self.flags = numpy.asarray(flags, dtype=numpy.uint8)
+        self.unbalancedLevels = []
+        self.unbalancedCodes = []
+        self.version += 1
+
+
+    def hilbertOrder(self):
+        '''
+        Returns an array of leaf indices in the order that a Hilbert curve over the whole mesh visits them. Each leaf
+        covers an aligned block of the finest cells, which the curve fills in one go, so the leaves can be sorted by
+        the position of any one finest cell inside them.
+        '''
+        bits = int(max(self.finestHorizontalCount, self.finestVerticalCount) - 1).bit_length()
+        i, j = mortonDecode(self.codes)
+        return numpy.argsort(hilbertEncode(i, j, bits), kind='stable')
+
+
+    def rootTiles(self, codes):
+        '''
+        Returns the index of the root cell containing each of the given Morton codes, numbered the same way as
+        Mesh.elements, i.e. i*verticalCellCount + j.
+        '''
+        i, j = mortonDecode(numpy.asarray(codes, dtype=numpy.uint64))
+        return (i >> self.maxLevel).astype(numpy.int64)*self.verticalCellCount + (j >> self.maxLevel).astype(numpy.int64)
+
+
+    def neighbourIndices(self, indices):
+        '''
+        Returns an array of shape (n, 4) with the index of the leaf across the right, top, left and bottom sides of
+        each of the n leaves at the given indices, or -1 on the edge of the mesh. Where the neighbours on a side are
+        smaller than the leaf, the one at the bottom or left end of that side is given.
+        '''
+        i, j = mortonDecode(self.codes[indices])
+        i = i.astype(numpy.int64)
+        j = j.astype(numpy.int64)
+        spans = numpy.left_shift(1, self.maxLevel - self.levels[indices].astype(numpy.int64))
+        return numpy.stack([self.leafIndicesAtFinestCoords(i + spans, j),
+                            self.leafIndicesAtFinestCoords(i, j + spans),
+                            self.leafIndicesAtFinestCoords(i - 1, j),
+                            self.leafIndicesAtFinestCoords(i, j - 1)], axis=1)
+
+
+    def markUnbalanced(self, indices):
+        '''
+        Asks balance() to check the leaves at the given indices (or boolean mask), as if they had just been split.
+        '''
+        self.unbalancedLevels.append(self.levels[indices])
+        self.unbalancedCodes.append(self.codes[indices])
+
+
+    def balance(self):
+        '''
+        Splits leaves until no leaf shares a side with a leaf more than twice its size. Only the leaves created
+        since the last call are checked, along with any leaves that have to be split along the way.
+
+        The leaves are handled one level at a time, from the finest level up. Splitting a neighbour only creates
+        leaves that are larger than the ones being checked, so each level is finished before its turn comes, and the
+        work done is proportional to the number of leaves created.
+        '''
+        for level in range(self.maxLevel, 1, -1):
+            levels = numpy.concatenate(self.unbalancedLevels + [numpy.zeros(0, dtype=numpy.uint8)])
+            codes = numpy.concatenate(self.unbalancedCodes + [numpy.zeros(0, dtype=numpy.uint64)])
+            pending = numpy.unique(codes[levels == level])
+
+            # Some of the recorded leaves may have been merged away since they were created.
+            indices = numpy.minimum(numpy.searchsorted(self.codes, pending), self.nLeaves() - 1)
+            pending = pending[(self.codes[indices] == pending) & (self.levels[indices] == level)]
+            if len(pending) == 0:
+                continue
+
+            while True:
+                # Leaves at this level are never split while it is being checked, so these are all still leaves.
+                indices = numpy.searchsorted(self.codes, pending)
+                neighbours = self.neighbourIndices(indices).ravel()
+                neighbours = neighbours[neighbours >= 0]
+                tooLarge = numpy.unique(neighbours[self.levels[neighbours] < level - 1])
+                if len(tooLarge) == 0:
+                    break
+                self.split(tooLarge)
+
+        self.unbalancedLevels = []
+        self.unbalancedCodes = []
@@ -23,112 +23,353 @@ This module provides some functions for loading paths in svg files into the Bezi
 pycfdmesh.geometry module.
 
 The svg files may be created in any compatible program (e.g. Inkscape).
-This module is very limited - it ignores anything in the file that is not a path, and looks only at the path 
-definition, ignoring any style that is specified.
-
-Only a limited subset of path commands available in the svg pecification have been implemented. The
-relative and absolute forms of the following commands are supported:
-    - moveto
-    - closepath
-    - lineto
-    - curveto
+This module ignores anything in the file that is not a path, and looks only at the path definition, ignoring any
+style or transform that is specified.
+
+The file is read as a stream, and each path is handed back as soon as it has been read, so only the path being read
+(and the elements around it) are ever held in memory. The relative and absolute forms of every path command in the
+svg specification are supported, including repeated commands with the command letter left out:
+    - moveto and closepath (M, Z)
+    - lineto (L, H, V)
+    - curveto and smooth curveto (C, S)
+    - quadratic and smooth quadratic curveto (Q, T), which are raised to cubics
+    - elliptical arc (A), which is approximated by a cubic for every quarter turn or less
+
+Flattening the paths into polygons can be shared between several processes, for drawings with many paths or very
+long ones. The polygons are exactly the same as when they're flattened in one process.
 '''
 
 
-from xml.dom import minidom
-from pycfdmesh.geometry import Point, CubicBezier, Beziergon
+import math
+import multiprocessing
+import re
+import numpy
+from xml.etree import ElementTree
+from pycfdmesh.geometry import Point, CubicBezier, Beziergon, ArrayLineList, flattenCubicBeziers
+
+
+# Matches either a command letter or a number. Numbers don't need anything between them when the next one starts
+# with a sign or a second decimal point, so "10-5.5.5" is 10, -5.5 and .5.
+_PATH_TOKEN = re.compile(r'([MmZzLlHhVvCcSsQqTtAa])|([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)')
+_LEADING_NUMBER = re.compile(r'\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)')
+
+# The number of values taken by each command.
+_PARAMETER_COUNTS = {'M': 2, 'Z': 0, 'L': 2, 'H': 1, 'V': 1, 'C': 6, 'S': 4, 'Q': 4, 'T': 2, 'A': 7}
+
+# When flattening to a tolerance in several processes, long paths are split into runs of this many curves.
+CURVES_PER_JOB = 2000
+
+
+
+def _localName(tag):
+    '''
+    Returns an xml tag without its namespace, e.g. "path" for "{http://www.w3.org/2000/svg}path".
+    '''
+    return tag.rsplit('}', 1)[-1]
+
+
+def _line(x0, y0, x1, y1):
+    '''
+    Returns a straight line as the control points of a cubic, with the controls a third of the way from each end so
+    that the curve is traced at a constant speed, and is flattened into a single line.
+    '''
+    return (x0, y0, (2*x0 + x1)/3, (2*y0 + y1)/3, (x0 + 2*x1)/3, (y0 + 2*y1)/3, x1, y1)
+
+
+def _arcToCubics(x0, y0, rx, ry, angle, largeArc, sweep, x1, y1):
+    '''
+    Returns a list of cubics (as tuples of control points) approximating an svg elliptical arc from (x0, y0) to
+    (x1, y1), using the conversion from end points to a centre given in the svg specification. Each cubic covers at
+    most a quarter turn.
+    '''
+    if x0 == x1 and y0 == y1:
+        return []
+    rx, ry = abs(rx), abs(ry)
+    if rx == 0 or ry == 0:
+        return [_line(x0, y0, x1, y1)]
+
+    cosAngle = math.cos(math.radians(angle))
+    sinAngle = math.sin(math.radians(angle))
+    dx, dy = (x0 - x1)/2, (y0 - y1)/2
+    x0p = cosAngle*dx + sinAngle*dy
+    y0p = -sinAngle*dx + cosAngle*dy
+
+    # Radii too small to reach from one end to the other are scaled up until they just reach.
+    scale = x0p*x0p/(rx*rx) + y0p*y0p/(ry*ry)
+    if scale > 1:
+        rx, ry = rx*math.sqrt(scale), ry*math.sqrt(scale)
+
+    numerator = rx*rx*ry*ry - rx*rx*y0p*y0p - ry*ry*x0p*x0p
+    denominator = rx*rx*y0p*y0p + ry*ry*x0p*x0p
+    factor = math.sqrt(max(numerator, 0)/denominator)
+    if largeArc == sweep:
+        factor = -factor
+    cxp = factor*rx*y0p/ry
+    cyp = -factor*ry*x0p/rx
+    cx = cosAngle*cxp - sinAngle*cyp + (x0 + x1)/2
+    cy = sinAngle*cxp + cosAngle*cyp + (y0 + y1)/2
+
+    startAngle = math.atan2((y0p - cyp)/ry, (x0p - cxp)/rx)
+    turn = math.atan2((-y0p - cyp)/ry, (-x0p - cxp)/rx) - startAngle
+    if sweep and turn < 0:
+        turn += 2*math.pi
+    elif not sweep and turn > 0:
+        turn -= 2*math.pi
+
+    nCurves = max(1, int(math.ceil(abs(turn)/(math.pi/2) - 1e-9)))
+    step = turn/nCurves
+    k = 4/3*math.tan(step/4)
+
+    def onPage(u, v):
+        return (cx + rx*cosAngle*u - ry*sinAngle*v, cy + rx*sinAngle*u + ry*cosAngle*v)
+
+    cubics = []
+    for n in range(nCurves):
+        a0 = startAngle + n*step
+        a1 = a0 + step
+        cos0, sin0, cos1, sin1 = math.cos(a0), math.sin(a0), math.cos(a1), math.sin(a1)
+        cubics.append(onPage(cos0, sin0) + onPage(cos0 - k*sin0, sin0 + k*cos0) +
+                      onPage(cos1 + k*sin1, sin1 - k*cos1) + onPage(cos1, sin1))
+    # The arc must end exactly where the next command starts.
+    cubics[0] = (x0, y0) + cubics[0][2:]
+    cubics[-1] = cubics[-1][:6] + (x1, y1)
+    return cubics
+
+
+def parsePathData(pathData):
+    '''
+    Takes the "d" attribute of an svg path, and returns a list of its subpaths, each a list of cubics given as tuples
+    of control points (x0, y0, x1, y1, x2, y2, x3, y3) in the svg's own coordinates.
+    '''
+    tokens = _PATH_TOKEN.findall(pathData)
+    subpaths = []
+    cubics = []
+    x, y = 0.0, 0.0
+    startX, startY = 0.0, 0.0
+    command = None
+    lastCubicControl = None
+    lastQuadraticControl = None
+    position = 0
+
+    while position < len(tokens):
+        letter = tokens[position][0]
+        if letter:
+            command = letter
+            position += 1
+        elif command is None:
+            raise Exception("Path data must start with a moveto: "+pathData[:50])
+
+        upper = command.upper()
+        relative = command != upper
+        values = []
+        while len(values) < _PARAMETER_COUNTS[upper] and position < len(tokens) and tokens[position][1]:
+            number = tokens[position][1]
+            # Arc flags are a single digit, and may be run together with the number after them.
+            if upper == 'A' and len(values) in (3, 4) and len(number) > 1:
+                tokens[position] = ('', number[1:])
+                number = number[0]
+            else:
+                position += 1
+            values.append(float(number))
+        if len(values) < _PARAMETER_COUNTS[upper]:
+            raise Exception("Path command "+command+" needs "+str(_PARAMETER_COUNTS[upper])+" values: "+pathData[:50])
+
+        dx, dy = (x, y) if relative else (0.0, 0.0)
+        cubicControl = None
+        quadraticControl = None
+
+        if upper == 'Z':
+            if cubics:
+                if (x, y) != (startX, startY):
+                    cubics.append(_line(x, y, startX, startY))
+                subpaths.append(cubics)
+                cubics = []
+            x, y = startX, startY
+            # Numbers after a closepath can't belong to it, so make sure they're reported rather than looping.
+            command = None
+
+        elif upper == 'M':
+            if cubics:
+                subpaths.append(cubics)
+                cubics = []
+            x, y = values[0] + dx, values[1] + dy
+            startX, startY = x, y
+            # Any more pairs of values after a moveto are lines.
+            command = 'l' if relative else 'L'
+
+        elif upper == 'L':
+            cubics.append(_line(x, y, values[0] + dx, values[1] + dy))
+            x, y = values[0] + dx, values[1] + dy
+
+        elif upper == 'H':
+            cubics.append(_line(x, y, values[0] + dx, y))
+            x = values[0] + dx
 
+        elif upper == 'V':
+            cubics.append(_line(x, y, x, values[0] + dy))
+            y = values[0] + dy
+
+        elif upper in 'CS':
+            if upper == 'C':
+                x1, y1 = values[0] + dx, values[1] + dy
+                values = values[2:]
+            elif lastCubicControl is not None:
+                # The first control is the last one of the previous curve, reflected through the current point.
+                x1, y1 = 2*x - lastCubicControl[0], 2*y - lastCubicControl[1]
+            else:
+                x1, y1 = x, y
+            x2, y2 = values[0] + dx, values[1] + dy
+            x3, y3 = values[2] + dx, values[3] + dy
+            cubics.append((x, y, x1, y1, x2, y2, x3, y3))
+            cubicControl = (x2, y2)
+            x, y = x3, y3
+
+        elif upper in 'QT':
+            if upper == 'Q':
+                qx, qy = values[0] + dx, values[1] + dy
+                values = values[2:]
+            elif lastQuadraticControl is not None:
+                qx, qy = 2*x - lastQuadraticControl[0], 2*y - lastQuadraticControl[1]
+            else:
+                qx, qy = x, y
+            x3, y3 = values[0] + dx, values[1] + dy
+            cubics.append((x, y, x + 2*(qx - x)/3, y + 2*(qy - y)/3, x3 + 2*(qx - x3)/3, y3 + 2*(qy - y3)/3, x3, y3))
+            quadraticControl = (qx, qy)
+            x, y = x3, y3
+
+        elif upper == 'A':
+            x3, y3 = values[5] + dx, values[6] + dy
+            cubics.extend(_arcToCubics(x, y, values[0], values[1], values[2], values[3] != 0, values[4] != 0, x3, y3))
+            x, y = x3, y3
+
+        lastCubicControl = cubicControl
+        lastQuadraticControl = quadraticControl
+
+    if cubics:
+        subpaths.append(cubics)
+    return subpaths
+
+
+def _toBeziergon(cubics, height):
+    '''
+    Turns a list of cubics in the svg's coordinates into a Beziergon, with y measured up from the bottom of the page.
+    '''
+    return Beziergon([CubicBezier(Point(c[0], height - c[1]), Point(c[2], height - c[3]),
+                                  Point(c[4], height - c[5]), Point(c[6], height - c[7])) for c in cubics])
+
+
+def iterBeziergonsFromSVG(filename):
+    '''
+    Takes the name of an svg file, and yields a Beziergon for each path defined in the file, as the file is read. 
+    The subpaths of a path are kept together in one Beziergon, one after the other, so that a path with holes in it
+    becomes a single polygon with a loop for each subpath (see EdgeIndex).
+    '''
+    height = 0.0
+    openElements = []
+    for event, element in ElementTree.iterparse(filename, events=('start', 'end')):
+        if event == 'start':
+            if not openElements and _localName(element.tag) == 'svg':
+                match = _LEADING_NUMBER.match(element.get('height', ''))
+                if match:
+                    height = float(match.group(1))
+            openElements.append(element)
+            continue
+
+        openElements.pop()
+        if _localName(element.tag) == 'path' and element.get('d'):
+            cubics = [cubic for subpath in parsePathData(element.get('d')) for cubic in subpath]
+            if cubics:
+                yield _toBeziergon(cubics, height)
+        # Nothing that has been read needs to be kept.
+        if openElements:
+            openElements[-1].remove(element)
 
 
 def beziergonsFromSVG(filename):
     '''
     Takes the name of an svg file, and returns a list of Beziergon objects generated from paths defined in the file.
     '''
-    svgfile = minidom.parse(filename)
-    height = float(svgfile.getElementsByTagName('svg')[0].attributes['height'].value.strip())
-    pathObjList = svgfile.getElementsByTagName('path')
+    return list(iterBeziergonsFromSVG(filename))
+
+
+def _approximateBeziergon(job):
+    '''
+    Runs in a worker process. Approximates a Beziergon by splitting its curves in half until they're nearly straight,
+    and returns the polygon.
+    '''
+    beziergon, minLineLength = job
+    return beziergon.approximateByPolygon().removeShortLines(minLineLength).toPolygon()
+
+
+def _flattenCurves(job):
+    '''
+    Runs in a worker process. Flattens a run of curves, given by their control point arrays, to a tolerance.
+    '''
+    xs, ys, tolerance = job
+    return flattenCubicBeziers(xs, ys, tolerance)
+
+
+def _mapJobs(function, jobs, processes):
+    '''
+    Returns [function(job) for job in jobs], with the jobs shared between "processes" processes if there's more than 
+    one of each.
+    '''
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if processes <= 1 or len(jobs) <= 1:
+        return [function(job) for job in jobs]
+    pool = multiprocessing.Pool(min(processes, len(jobs)))
+    try:
+        # The jobs can take very different amounts of time, so they're handed out one at a time.
+        return pool.map(function, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def polygonsFromBeziergons(beziergons, minLineLength = 0, tolerance = None, processes = 1):
+    '''
+    Returns a list of polygons approximating a list of Beziergons, in the same order, as described for 
+    polygonsFromSVG. The work is shared between "processes" processes (all the CPUs if it's None). Without a 
+    tolerance, each process takes a whole Beziergon at a time. With one, the curves of long Beziergons are also 
+    split into runs of CURVES_PER_JOB, and the lines are put back together before short lines are removed.
+    '''
+    if tolerance is None:
+        return _mapJobs(_approximateBeziergon, [(b, minLineLength) for b in beziergons], processes)
     
-    beziergonList = []
+    jobs = []
+    jobCounts = []
+    for b in beziergons:
+        xs, ys = b.getControlArrays()
+        starts = range(0, len(xs), CURVES_PER_JOB)
+        jobs.extend((xs[k:k+CURVES_PER_JOB], ys[k:k+CURVES_PER_JOB], tolerance) for k in starts)
+        jobCounts.append(len(starts))
+    results = _mapJobs(_flattenCurves, jobs, processes)
     
-    for p in pathObjList:
-        pathStr = p.attributes['d'].value
-        curveStrList = pathStr.split(' ')
-        currentPoint = Point (0,0)
-        nextPoint = Point (0,0)
-        relative = False
-        curveType = 'start'
-        pointType = 'end'
-        curveBezierList = []
-        for c in curveStrList:
-            if not c.upper() in ['M','C','Z','L']:
-                p = c.split(',')
-                nextPoint = Point(float(p[0].strip()), float(p[1].strip()))
-                if relative:
-                    nextPoint = currentPoint + nextPoint
-                
-                if curveType == 'start':
-                    currentPoint = nextPoint
-                    curveType = 'line'
-#                    print('Jumping to', currentPoint.switchReference(height))
-                    
-                
-                elif curveType == 'cubic':
-                    if pointType == 'end':
-                        pointType = 'control1'
-                        startPoint = currentPoint.switchReference(height)
-                        firstControl = (nextPoint).switchReference(height)
-                        
-#                        print('Starting curve from', startPoint, 'with first control', firstControl)
-                    elif pointType == 'control1':
-                        pointType = 'control2'
-                        secondControl = (nextPoint).switchReference(height)
-#                        print('    Next control', secondControl)
-                    elif pointType == 'control2':
-                        pointType = 'end'
-                        currentPoint = nextPoint
-                        endPoint = currentPoint.switchReference(height)
-#                        print('    Ending curve at', endPoint)
-                        curveBezierList.append(CubicBezier(startPoint, firstControl, secondControl, endPoint))
-                        
-                elif curveType == 'line':
-                    startPoint = currentPoint.switchReference(height)
-                    currentPoint = nextPoint
-                    endPoint = currentPoint.switchReference(height)
-#                    print('Inserting line from', startPoint, 'to', endPoint)
-                    curveBezierList.append(CubicBezier(startPoint, startPoint, endPoint, endPoint))
-                    
-            else:
-                if c==c.lower():
-                    relative = True
-                else:
-                    relative = False
-                if c.upper() == 'M':
-                    curveType = 'start'
-                elif c.upper() == 'L':
-                    curveType = 'line'
-                elif c.upper() == 'C':
-                    curveType = 'cubic'
-                elif c.upper() == 'Z':
-                    startPoint = curveBezierList[-1].p3
-                    endPoint = curveBezierList[0].p0
-                    if startPoint == endPoint:
-#                        print('Ending. Path already closed')
-                        pass
-                    else:
-#                        print('Ending. Closing path between', startPoint, 'and', endPoint)
-                        curveBezierList.append(CubicBezier(startPoint, startPoint, endPoint, endPoint))
-#                    print()
-                else:
-#                    print('Unrecognised command: ',c)
-                    pass
-        beziergonList.append(Beziergon(curveBezierList))
-    return beziergonList
-
-
-def polygonsFromSVG(filename, minLineLength = 0):
-    blist = beziergonsFromSVG(filename)
     polygonList = []
-    for b in blist:
-        polygonList.append(b.approximateByPolygon().removeShortLines(minLineLength).toPolygon())
+    first = 0
+    for count in jobCounts:
+        pieces = results[first:first+count]
+        first += count
+        edgeArrays = [numpy.concatenate([piece[k] for piece in pieces] + [numpy.zeros(0)]) for k in range(4)]
+        polygonList.append(ArrayLineList(*edgeArrays).removeShortLines(minLineLength).toPolygon())
     return polygonList
 
+
+def polygonsFromSVG(filename, minLineLength = 0, tolerance = None, processes = 1):
+    '''
+    Takes the name of an svg file, and returns a list of polygons approximating the paths in the file, with lines
+    shorter than minLineLength merged into their neighbours. If "tolerance" is given, the curves are flattened so
+    that no line is further than that from its curve, and the polygons are ArrayPolygons. Otherwise, each curve is
+    split in half until it's nearly straight. If "processes" is more than 1 (or None, for all the CPUs), the paths
+    are flattened in that many processes.
+    '''
+    if processes != 1:
+        return polygonsFromBeziergons(list(iterBeziergonsFromSVG(filename)), minLineLength, tolerance, processes)
+    polygonList = []
+    for b in iterBeziergonsFromSVG(filename):
+        if tolerance is None:
+            polygonList.append(b.approximateByPolygon().removeShortLines(minLineLength).toPolygon())
+        else:
+            polygonList.append(b.flatten(tolerance).removeShortLines(minLineLength).toPolygon())
+    return polygonList
@@ -0,0 +1,153 @@
+'''
+This file is a part of BreezyNS - a simple, general-purpose 2D airflow calculator.
+
+Copyright (c) 2013, Brendan Gray
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+
+
+Created on 17 Oct 2026
+
+@author: AlphanumericSheepPig
+
+A module which provides a FlowField class, holding the solution vector of every cell of a mesh.
+
+The four conserved variables are each kept in one contiguous array, with one entry per leaf of the mesh's quadtree
+(in the same order as the quadtree arrays), so that the solver can work on every cell at once. A SolutionVector
+for a single cell can still be had from FlowField.getSolution, and reads and writes the field directly.
+'''
+
+import numpy
+from pycfdsolver.navierstokes import SolutionVector
+from pycfdsolver.stateequation import pressureFromPrimitives
+
+
+
+class FlowField():
+    '''
+    The conserved variables of every cell, as the rows of FlowField.conserved, which has shape (4, n):
+        FlowField.density is the density, rho.
+        FlowField.momentumX and FlowField.momentumY are the momentum per unit volume, rho*u and rho*v.
+        FlowField.energy is the total energy per unit volume, rho*E, including the kinetic energy.
+    Each of these is a view of its row, so writing to it changes the field.
+    '''
+
+    def __init__(self, nCells):
+        self.conserved = numpy.zeros((4, nCells))
+        self.version = None
+
+
+    @classmethod
+    def forMesh(cls, mesh):
+        '''
+        Returns an empty FlowField with a cell for each leaf of a mesh. FlowField.version is set to the mesh's 
+        version, so a field that no longer matches the mesh can be recognised.
+        '''
+        field = cls(mesh.quadtree.nLeaves())
+        field.version = mesh.version
+        return field
+
+
+    @property
+    def density(self):
+        return self.conserved[0]
+
+
+    @property
+    def momentumX(self):
+        return self.conserved[1]
+
+
+    @property
+    def momentumY(self):
+        return self.conserved[2]
+
+
+    @property
+    def energy(self):
+        return self.conserved[3]
+
+
+    def nCells(self):
+        return self.conserved.shape[1]
+
+
+    def set(self, rho, u, v, totalEnergy, cells = None):
+        '''
+        Sets the conserved variables from the density, velocity components and total energy per unit mass, like 
+        SolutionVector.set. Each may be a number or an array. If "cells" is given (an index array, mask or slice), 
+        only those cells are set.
+        '''
+        if cells is None:
+            cells = slice(None)
+        rho = numpy.asarray(rho, dtype=float)
+        self.conserved[0, cells] = rho
+        self.conserved[1, cells] = rho*u
+        self.conserved[2, cells] = rho*v
+        self.conserved[3, cells] = rho*totalEnergy
+        return self
+
+
+    def getDensity(self):
+        return self.conserved[0]
+
+
+    def getVelocity(self):
+        '''
+        Returns arrays (u, v) of the velocity components of every cell.
+        '''
+        return self.conserved[1]/self.conserved[0], self.conserved[2]/self.conserved[0]
+
+
+    def getTotalEnergy(self):
+        # As in SolutionVector, this is per unit mass and includes the kinetic energy.
+        return self.conserved[3]/self.conserved[0]
+
+
+    def getPressure(self, model = "IdealGas"):
+        u, v = self.getVelocity()
+        return pressureFromPrimitives(self.conserved[0], u*u + v*v, self.getTotalEnergy(), model)
+
+
+    def getSolution(self, index):
+        '''
+        Returns a SolutionVector for one cell, which reads from and writes to the field.
+        '''
+        return SolutionVector(self, index)
+
+
+    def perCell(self):
+        '''
+        Returns a view of the field with shape (n, 4), one row per cell. This is the layout expected by 
+        Subdomain.gather and HaloExchange.exchange.
+        '''
+        return self.conserved.T
+
+
+    def subset(self, cells):
+        '''
+        Returns a new FlowField holding a copy of some of the cells, in the order given.
+        '''
+        field = FlowField(0)
+        field.conserved = numpy.ascontiguousarray(self.conserved[:, cells])
+        return field
+
+
+    def copy(self):
+        field = FlowField(0)
+        field.conserved = self.conserved.copy()
+        field.version = self.version
+        return field
+
+
+    def __repr__(self):
+        return "FlowField with "+str(self.nCells())+" cells."
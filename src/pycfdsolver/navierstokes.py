@@ -29,10 +29,15 @@ where dA/dn denotes the partial derivative of the vector A with respect to the i
 
 The solution vector U may be stored as SolutionVector object,
 and the flux vectors Fx and Fy may be stored as FluxVector objects.  
+
+The solution for a whole mesh is kept in a pycfdsolver.flowfield.FlowField, and a SolutionVector can be a view of one
+of its cells. The fluxes through every face of a mesh are found at once by calculateFluxes, with FluxVector kept as
+the reference for a single cell.
 '''
 
+import numpy
 from pycfdalg.basicvector import Vector
-from pycfdsolver.stateequation import pressure
+from pycfdsolver.stateequation import pressure, pressureFromPrimitives
 from pycfdsolver.shearstress import ShearTensor
         
     
@@ -40,9 +45,13 @@ from pycfdsolver.shearstress import ShearTensor
 class SolutionVector(Vector):
     '''
     A special case vector of length 4 for a 2d solution, with methods for extracting primitive variables.
+    If a FlowField and a cell index are given, the vector is a view of that cell of the field, and setting it
+    changes the field.
     '''
-    def __init__(self):
+    def __init__(self, field = None, index = None):
         Vector.__init__(self,4)
+        if field is not None:
+            self.vect = field.conserved[:, index]
     
     def set(self, rho, vel, totalEnergy):
         Vector.set(self, rho, rho*vel.x(), rho*vel.y(), rho*totalEnergy)
@@ -125,7 +134,57 @@ class FluxVector(Vector):
         
     
 
-        
+
+
+def calculateFluxes(conserved, normalX, normalY, stresses = None, model = "IdealGas"):
+    '''
+    Calculates the mass, momentum and energy fluxes through many faces at once. "conserved" has shape (4, n), and
+    holds the solution vector to use at each face (e.g. the columns of FlowField.conserved). Returns an array of shape
+    (4, n) of the fluxes in the direction of each face's normal, Fx*normalX + Fy*normalY, which is the same as 
+    FluxVector(0) for a normal of (1, 0), and FluxVector(1) for (0, 1).
+    
+    "stresses" may be a tuple of arrays (xx, xy, yx, yy) of the shear tensor at each face. It defaults to zero, the 
+    same as ShearTensor.
+    '''
+    rho, momentumX, momentumY, energy = conserved
+    u = momentumX/rho
+    v = momentumY/rho
+    p = pressureFromPrimitives(rho, u*u + v*v, energy/rho, model)
+    normalVelocity = u*normalX + v*normalY
+    
+    fluxes = numpy.empty(numpy.shape(conserved))
+    fluxes[0] = rho*normalVelocity
+    fluxes[1] = momentumX*normalVelocity + p*normalX
+    fluxes[2] = momentumY*normalVelocity + p*normalY
+    fluxes[3] = (energy + p)*normalVelocity
+    
+    if stresses is not None:
+        xx, xy, yx, yy = stresses
+        # The viscous stress on the face, which is the shear tensor applied to the normal.
+        stressX = xx*normalX + yx*normalY
+        stressY = xy*normalX + yy*normalY
+        fluxes[1] -= stressX
+        fluxes[2] -= stressY
+        fluxes[3] -= stressX*u + stressY*v
+    
+    return fluxes
+
+
+
+def centralFaceFluxes(field, faceTable, stresses = None, model = "IdealGas"):
+    '''
+    Returns an array of shape (4, n) of the fluxes through every face of a FaceTable, per unit length, in the 
+    direction of the face normals. Each is the average of the fluxes worked out from the cells on either side, 
+    with the cell inside used on its own at the edge of the mesh. "field" is a FlowField for the same mesh.
+    '''
+    right = numpy.where(faceTable.right >= 0, faceTable.right, faceTable.left)
+    leftFluxes = calculateFluxes(field.conserved[:, faceTable.left], faceTable.normalX, faceTable.normalY, 
+                                 stresses, model)
+    rightFluxes = calculateFluxes(field.conserved[:, right], faceTable.normalX, faceTable.normalY, stresses, model)
+    return (leftFluxes + rightFluxes)/2
+
+
+
 def test():
     v = Vector(4)
     v.set(1,4,5,5)
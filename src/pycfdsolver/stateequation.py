@@ -36,10 +36,17 @@ def pressure(solution, model = "IdealGas"):
     vel = solution.getVelocity()
     e = solution.getTotalEnergy()
 
+    return pressureFromPrimitives(rho, vel.sumOfSquares(), e, model)
+
+
+
+def pressureFromPrimitives(rho, speedsqr, e, model = "IdealGas"):
+    '''
+    Calculates the pressure from the density, the square of the speed and the total energy per unit mass, using the
+    same models as pressure. The arguments may be numbers or numpy arrays, so a whole field can be done at once.
+    '''
     if model == "IdealGas":
         gamma = 1.4
-        speedsqr = vel.sumOfSquares()
-        
         p = (gamma - 1)*rho*(e-speedsqr/2)
         
     else:
@@ -20,7 +20,8 @@ Created on 26 Nov 2013
 '''
 
 from pycfdalg.basicvector import Vector
-from pycfdsolver.navierstokes import SolutionVector, FluxVector
+from pycfdsolver.navierstokes import FluxVector
+from pycfdsolver.flowfield import FlowField
 #from pycfdsolver.stateequation import pressure
 
 
@@ -30,7 +31,8 @@ pressure = 101325
 gamma = 1.4
 energy = (1/(gamma-1))*pressure/rho + vel.sumOfSquares()/2
 
-s = SolutionVector()
+field = FlowField(1)
+s = field.getSolution(0)
 s.set(rho, vel, energy)
 
 print ("Solution:",s)